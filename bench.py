@@ -0,0 +1,470 @@
+"""Load test for Bumpy's hot paths against a local Postgres.
+
+Seeds synthetic users into a throwaway `bumpy_bench` schema, then drives
+reminder_loop, reset_loop, $drink and $report against a fake Discord layer
+that adds send latency and answers with 429s the way Discord's per-channel
+and global limits would. Nothing here talks to Discord.
+
+    BENCH_DATABASE_URL=postgresql://localhost/bumpy_bench python bench.py --users 50000
+
+The schema is dropped and recreated on every run, so point this at a scratch
+database, never at production.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import resource
+import sys
+import tempfile
+import time
+import types
+from collections import Counter
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+
+BENCH_SCHEMA = "bumpy_bench"
+BENCH_DATABASE_URL = os.getenv("BENCH_DATABASE_URL")
+if not BENCH_DATABASE_URL:
+    sys.exit("Set BENCH_DATABASE_URL to a scratch Postgres database.")
+
+# Must be set before bumpy reads its config at import time
+sep = "&" if "?" in BENCH_DATABASE_URL else "?"
+os.environ["DATABASE_URL"] = f"{BENCH_DATABASE_URL}{sep}search_path={BENCH_SCHEMA}"
+os.environ.setdefault("METRICS_PORT", "0")
+os.environ.setdefault("INGEST_JOURNAL_PATH", os.path.join(tempfile.mkdtemp(), "bench.journal"))
+
+import asyncpg
+import discord
+import bumpy
+
+TIMEZONES = (
+    "UTC", "Europe/London", "Europe/Berlin", "Europe/Moscow", "Asia/Dubai", "Asia/Kolkata",
+    "Asia/Shanghai", "Asia/Tokyo", "Australia/Sydney", "Pacific/Auckland", "America/Sao_Paulo",
+    "America/New_York", "America/Chicago", "America/Denver", "America/Los_Angeles", "Pacific/Honolulu",
+)
+INTERVALS = (30, 45, 60, 90, 120)
+MENTION = re.compile(r"<@(\d+)>")
+
+# ---------------- Fake Discord ----------------
+class FakeChannel:
+    def __init__(self, sim, channel_id: int, closed: bool = False):
+        self.sim = sim
+        self.id = channel_id
+        self.closed = closed
+
+    async def send(self, content=None, **kwargs):
+        return await self.sim.deliver(self, content or "")
+
+class FakeDiscord:
+    """Per-channel (5 per 5 s) and global (50 per s) fixed windows, like
+    Discord's buckets. A 429 is reported to the outbound dispatcher through
+    the same hook the aiohttp trace uses, then retried after Retry-After,
+    which is what discord.py does internally."""
+
+    def __init__(self, latency: float, jitter: float, dm_closed: float, rng: random.Random):
+        self.latency = latency
+        self.jitter = jitter
+        self.dm_closed = dm_closed
+        self.rng = rng
+        self.channels = {}
+        self._windows = {}
+        self.deadlines = {}
+        self.delivered = {}
+        self.per_second = Counter()
+        self.started = time.monotonic()
+        self.sends = 0
+        self.rate_limited = 0
+
+    def get_channel(self, channel_id: int):
+        if channel_id is None:
+            return None
+        channel = self.channels.get(channel_id)
+        if channel is None:
+            channel = self.channels[channel_id] = FakeChannel(self, channel_id)
+        return channel
+
+    async def create_dm(self, user):
+        await asyncio.sleep(self._latency())
+        return FakeChannel(self, user.id, closed=self.rng.random() < self.dm_closed)
+
+    def _latency(self) -> float:
+        return max(0.0, self.rng.gauss(self.latency, self.jitter))
+
+    def _take(self, key, limit: int, window: float, now: float):
+        """(retry_after, remaining, reset_after) for one request against a window."""
+        start, used = self._windows.get(key, (now, 0))
+        if now - start >= window:
+            start, used = now, 0
+        reset_after = start + window - now
+        if used >= limit:
+            return reset_after, 0, reset_after
+        self._windows[key] = (start, used + 1)
+        return 0.0, limit - used - 1, reset_after
+
+    async def deliver(self, channel: FakeChannel, content: str):
+        path = f"/api/v10/channels/{channel.id}/messages"
+        while True:
+            await asyncio.sleep(self._latency())
+            if channel.closed:
+                raise discord.Forbidden(types.SimpleNamespace(status=403, reason="Forbidden"), "Cannot send messages to this user")
+            now = time.monotonic()
+            retry, _, _ = self._take("global", 50, 1.0, now)
+            headers = {"Retry-After": f"{retry:.3f}", "X-RateLimit-Global": "true"}
+            if not retry:
+                retry, remaining, reset_after = self._take(channel.id, 5, 5.0, now)
+                headers = {"Retry-After": f"{retry:.3f}"}
+            if retry:
+                self.rate_limited += 1
+                bumpy.outbound.on_http_response(path, 429, headers)
+                await asyncio.sleep(retry)
+                continue
+            bumpy.outbound.on_http_response(path, 200, {
+                "X-RateLimit-Remaining": str(remaining),
+                "X-RateLimit-Reset-After": f"{reset_after:.3f}",
+            })
+            break
+
+        self.sends += 1
+        self.per_second[int(now - self.started)] += 1
+        if content.startswith("💧"):
+            delivered_at = time.time()
+            for uid in MENTION.findall(content):
+                self.delivered.setdefault(int(uid), delivered_at)
+
+    def lateness(self) -> list:
+        return sorted(t - self.deadlines[uid] for uid, t in self.delivered.items() if uid in self.deadlines)
+
+    def send_rate(self) -> dict:
+        if not self.per_second:
+            return {"peak": 0, "avg": 0.0, "peak_to_avg": 0.0}
+        first, last = min(self.per_second), max(self.per_second)
+        avg = self.sends / (last - first + 1)
+        peak = max(self.per_second.values())
+        return {"peak": peak, "avg": avg, "peak_to_avg": peak / avg}
+
+class FakeUser:
+    def __init__(self, uid: int):
+        self.id = uid
+        self.display_name = f"bench-{uid}"
+        self.bot = False
+
+class FakeMessage:
+    def __init__(self, author, channel, content: str):
+        self.author = author
+        self.channel = channel
+        self.content = content
+
+class FakeContext:
+    def __init__(self, sim, uid: int, channel_id: int):
+        self.author = FakeUser(uid)
+        self.channel = sim.get_channel(channel_id)
+
+    async def send(self, content=None, **kwargs):
+        return await self.channel.send(content, **kwargs)
+
+class ReplyContext:
+    """A context whose replies are kept instead of sent, for checking what a
+    command answered. Each gets its own route, so outbound never throttles it."""
+
+    def __init__(self, uid: int, channel_id: int):
+        self.author = FakeUser(uid)
+        self.channel = types.SimpleNamespace(id=channel_id)
+        self.replies = []
+
+    async def send(self, content=None, **kwargs):
+        self.replies.append(content or "")
+
+def install_fakes(sim: FakeDiscord):
+    bumpy.bot.get_channel = sim.get_channel
+    bumpy.bot.get_user = lambda uid: None
+    bumpy.bot.create_dm = sim.create_dm
+
+# ---------------- DB accounting ----------------
+db_queries = 0
+
+def count_query(record):
+    global db_queries
+    db_queries += 1
+
+def install_query_counter():
+    """Count statements as well as pool acquires; one acquire can run several."""
+    real_db = bumpy.db
+
+    @asynccontextmanager
+    async def counting_db():
+        async with real_db() as conn:
+            conn.add_query_logger(count_query)
+            try:
+                yield conn
+            finally:
+                conn.remove_query_logger(count_query)
+
+    if hasattr(asyncpg.Connection, "add_query_logger"):
+        bumpy.db = counting_db
+
+def db_counts():
+    return bumpy.db_stats["acquires"], db_queries
+
+# ---------------- Seeding ----------------
+async def reset_schema():
+    conn = await asyncpg.connect(BENCH_DATABASE_URL)
+    try:
+        await conn.execute(f"DROP SCHEMA IF EXISTS {BENCH_SCHEMA} CASCADE; CREATE SCHEMA {BENCH_SCHEMA};")
+    finally:
+        await conn.close()
+
+async def seed(args, sim: FakeDiscord, rng: random.Random):
+    """Users spread over timezones and intervals, all due within --spread
+    seconds; most of them have something logged for yesterday."""
+    now = datetime.now(timezone.utc)
+    due_from = now + timedelta(seconds=args.warmup)
+    channels = max(1, args.users // args.users_per_channel)
+    users, logs = [], []
+    for i in range(args.users):
+        # Snowflake-like ids, so (id >> 22) spreads users over reminder partitions
+        uid = ((i + 1) << 22) | rng.getrandbits(22)
+        tz_name = rng.choice(TIMEZONES)
+        interval = rng.choice(INTERVALS)
+        in_channel = rng.random() >= args.dm_share
+        reminder_channel = 1000 + rng.randrange(channels) if in_channel else None
+        log_channel = 1000 + rng.randrange(channels) if rng.random() < args.log_share else None
+        due = due_from + timedelta(seconds=rng.uniform(0, args.spread))
+        users.append((
+            uid, f"bench-{i}", 30, 2000, "ml", tz_name, reminder_channel,
+            log_channel, True, None, False, False, None, None, interval, due,
+        ))
+        if rng.random() < 0.7:
+            yesterday = now.astimezone(bumpy.get_tz(tz_name)).date() - timedelta(days=1)
+            logs.append((uid, yesterday, rng.randrange(500, 3000)))
+
+    async with bumpy.db() as conn:
+        await conn.copy_records_to_table("users", records=users, columns=[
+            "id", "name", "age", "daily_goal", "unit", "timezone", "reminder_channel",
+            "log_channel", "ping_self", "coach_role", "coach_ping_logs", "coach_ping_reminders",
+            "last_reset", "last_reminder", "interval_minutes", "next_reminder_at",
+        ])
+        await conn.copy_records_to_table("daily_logs", records=logs, columns=["user_id", "date", "total"])
+        await conn.execute("ANALYZE")
+    return [u[0] for u in users], channels
+
+# ---------------- Scenarios ----------------
+def percentile(values, p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+def summarize(durations) -> dict:
+    return {
+        "count": len(durations),
+        "p50": percentile(durations, 50),
+        "p99": percentile(durations, 99),
+        "max": max(durations, default=0.0),
+    }
+
+async def bench_reminders(sim: FakeDiscord) -> dict:
+    await bumpy.load_reminder_schedule(range(bumpy.REMINDER_PARTITIONS))
+    # Lateness is measured from the smoothed deadlines the bot actually scheduled
+    sim.deadlines = {uid: bumpy.reminders.deadline(uid) for uid in bumpy.reminders.keys()}
+    last_deadline = max(sim.deadlines.values(), default=0)
+    ticks, acquires, queries = [], [], []
+    started = time.perf_counter()
+    while True:
+        ts = bumpy.reminders.peek()
+        if ts is None or ts > last_deadline:
+            break
+        await bumpy.reminders.wait()
+        a0, q0 = db_counts()
+        t0 = time.perf_counter()
+        await bumpy.run_reminder_tick(datetime.now(timezone.utc))
+        ticks.append(time.perf_counter() - t0)
+        a1, q1 = db_counts()
+        acquires.append(a1 - a0)
+        queries.append(q1 - q0)
+    elapsed = time.perf_counter() - started
+    lateness = sim.lateness()
+    return {
+        "elapsed": elapsed,
+        "ticks_per_sec": len(ticks) / elapsed if elapsed else 0.0,
+        "tick_seconds": summarize(ticks),
+        "delivered": len(lateness),
+        "lateness_p50": percentile(lateness, 50),
+        "lateness_p99": percentile(lateness, 99),
+        "db_acquires_per_tick": sum(acquires) / len(ticks) if ticks else 0.0,
+        "db_queries_per_tick": sum(queries) / len(ticks) if ticks else 0.0,
+    }
+
+async def bench_reset() -> dict:
+    async with bumpy.db() as conn:
+        zones = await conn.fetch("SELECT DISTINCT coalesce(timezone, 'UTC') AS tz FROM users")
+    now_utc = datetime.now(timezone.utc)
+    for z in zones:
+        bumpy.midnights.schedule(z["tz"], now_utc)
+    a0, q0 = db_counts()
+    t0 = time.perf_counter()
+    await bumpy.run_reset_tick(now_utc)
+    elapsed = time.perf_counter() - t0
+    a1, q1 = db_counts()
+    return {"timezones": len(zones), "tick_seconds": elapsed, "db_acquires": a1 - a0, "db_queries": q1 - q0}
+
+async def bench_drink(sim: FakeDiscord, uids, channels: int, count: int, rng: random.Random) -> dict:
+    async def one(uid):
+        ctx = FakeContext(sim, uid, 1000 + rng.randrange(channels))
+        t0 = time.perf_counter()
+        command = asyncio.create_task(bumpy.drink.callback(ctx))
+        # Let the command open its session, then answer both questions through the router
+        await asyncio.sleep(0)
+        for answer in (rng.choice(("ml", "oz")), str(rng.randrange(50, 500))):
+            bumpy.sessions.feed(FakeMessage(ctx.author, ctx.channel, answer))
+        await command
+        return time.perf_counter() - t0
+
+    a0, q0 = db_counts()
+    started = time.perf_counter()
+    durations = await asyncio.gather(*(one(uid) for uid in rng.sample(uids, min(count, len(uids)))))
+    elapsed = time.perf_counter() - started
+    t0 = time.perf_counter()
+    await bumpy.ingest.flush()
+    flush = time.perf_counter() - t0
+    a1, q1 = db_counts()
+    return {
+        "commands_per_sec": len(durations) / elapsed if elapsed else 0.0,
+        "command_seconds": summarize(durations),
+        "flush_seconds": flush,
+        "db_acquires": a1 - a0,
+        "db_queries": q1 - q0,
+    }
+
+async def seed_history(uids, days: int, rng: random.Random):
+    """A few drinks a day at random local hours for the last `days` days,
+    through the same writes the ingest flush does, plus compacted
+    events_hourly rows from before that."""
+    async with bumpy.db() as conn:
+        zones = {r["id"]: r["tz"] for r in await conn.fetch(
+            "SELECT id, coalesce(timezone, 'UTC') AS tz FROM users WHERE id = ANY($1::bigint[])", uids
+        )}
+    today = datetime.now(timezone.utc).date()
+    events, hourly, totals = [], [], []
+    for uid in uids:
+        tz = bumpy.get_tz(zones[uid])
+        for back in range(1, 3 * days):
+            day = today - timedelta(days=back)
+            for _ in range(rng.randrange(2, 7)):
+                local = tz.localize(datetime.combine(day, datetime.min.time()) + timedelta(
+                    hours=rng.randrange(7, 23), minutes=rng.randrange(60)
+                ))
+                amount = rng.randrange(100, 600)
+                totals.append((uid, local, amount))
+                if back < days:
+                    events.append((uid, local, amount, "ml", "manual", "bench", None))
+                else:
+                    hour = local.astimezone(timezone.utc).replace(minute=0)
+                    hourly.append((uid, hour, "manual", "ml", amount, 1))
+    async with bumpy.db() as conn:
+        async with conn.transaction():
+            await bumpy.insert_events(conn, events)
+            await conn.executemany("""
+                INSERT INTO events_hourly AS h (user_id, hour, kind, unit, amount, events)
+                VALUES ($1, $2, $3, $4, $5, $6)
+                ON CONFLICT (user_id, hour, kind, unit) DO UPDATE
+                SET amount = h.amount + EXCLUDED.amount, events = h.events + EXCLUDED.events
+            """, hourly)
+            await bumpy.add_daily_totals(conn, totals)
+        await conn.execute("ANALYZE")
+
+async def bench_report(uids, count: int, rng: random.Random) -> dict:
+    """Run $report over seeded history and check every reply is a full report,
+    hourly profile included."""
+    sample = rng.sample(uids, min(count, len(uids)))
+    await seed_history(sample, 30, rng)
+    durations = []
+    a0, q0 = db_counts()
+    for i, uid in enumerate(sample):
+        for span in ("week", "all"):
+            ctx = ReplyContext(uid, 10**9 + i)
+            t0 = time.perf_counter()
+            await bumpy.report.callback(ctx, span)
+            durations.append(time.perf_counter() - t0)
+            reply = ctx.replies[-1] if ctx.replies else ""
+            if "By hour" not in reply:
+                raise AssertionError(f"$report {span} for {uid} answered {reply!r}")
+    a1, q1 = db_counts()
+    return {
+        "report_seconds": summarize(durations),
+        "db_acquires_per_report": (a1 - a0) / len(durations) if durations else 0.0,
+        "db_queries_per_report": (q1 - q0) / len(durations) if durations else 0.0,
+    }
+
+# ---------------- Main ----------------
+def peak_rss_mb() -> float:
+    # ru_maxrss is KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def print_report(results: dict):
+    for section, values in results.items():
+        print(f"[{section}]")
+        for key, value in values.items():
+            if isinstance(value, dict):
+                value = "  ".join(f"{k}={v:.4g}" for k, v in value.items())
+            elif isinstance(value, float):
+                value = f"{value:.4g}"
+            print(f"  {key:<22} {value}")
+
+async def main(args):
+    rng = random.Random(args.seed)
+    sim = FakeDiscord(args.latency_ms / 1000, args.jitter_ms / 1000, args.dm_closed, rng)
+    install_fakes(sim)
+    install_query_counter()
+
+    await reset_schema()
+    await bumpy.init_pool()
+    await bumpy.migrate()
+    bumpy.ingest.open()
+    bumpy.leases.owned = set(range(bumpy.REMINDER_PARTITIONS))
+
+    t0 = time.perf_counter()
+    uids, channels = await seed(args, sim, rng)
+    results = {"seed": {"users": len(uids), "channels": channels, "seconds": time.perf_counter() - t0}}
+
+    if "reminders" in args.scenarios:
+        results["reminders"] = await bench_reminders(sim)
+    if "reset" in args.scenarios:
+        results["reset"] = await bench_reset()
+    if "drink" in args.scenarios:
+        results["drink"] = await bench_drink(sim, uids, channels, args.drinks, rng)
+    if "report" in args.scenarios:
+        results["report"] = await bench_report(uids, args.reports, rng)
+
+    results["sends"] = {"total": sim.sends, "rate_limited": sim.rate_limited, **sim.send_rate()}
+    results["memory"] = {
+        "peak_rss_mb": peak_rss_mb(),
+        "user_cache_size": bumpy.user_cache.stats()["size"],
+        "dm_cache_size": bumpy.dm_channels.stats()["size"],
+    }
+    print_report(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    await bumpy.db_pool.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--users-per-channel", type=int, default=50)
+    parser.add_argument("--dm-share", type=float, default=0.3, help="fraction of users reminded by DM")
+    parser.add_argument("--dm-closed", type=float, default=0.05, help="fraction of DMs that answer 403")
+    parser.add_argument("--log-share", type=float, default=0.5, help="fraction of users with a log channel")
+    parser.add_argument("--spread", type=float, default=60, help="seconds over which reminders fall due")
+    parser.add_argument("--warmup", type=float, default=5, help="seconds before the first reminder is due")
+    parser.add_argument("--drinks", type=int, default=2000)
+    parser.add_argument("--reports", type=int, default=200, help="users to run $report for")
+    parser.add_argument("--latency-ms", type=float, default=80)
+    parser.add_argument("--jitter-ms", type=float, default=30)
+    parser.add_argument("--scenarios", nargs="+", default=["reminders", "reset", "drink", "report"],
+                        choices=["reminders", "reset", "drink", "report"])
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="also write the results to this file, for comparing runs")
+    asyncio.run(main(parser.parse_args()))
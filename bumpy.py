@@ -1,28 +1,356 @@
+import aiohttp
 import discord
 from discord.ext import commands, tasks
 import asyncpg
+import asyncio
+import bisect
+import csv
+import functools
+import gzip
+import heapq
+import io
+import itertools
+import json
 import os
-from datetime import datetime, timedelta
+import re
+import time
+import uuid
+import zlib
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+from datetime import date, datetime, timedelta, timezone
 import pytz
 
 TOKEN = os.getenv("DISCORD_TOKEN")
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-intents = discord.Intents.default()
-intents.message_content = True
-intents.guilds = True
-intents.members = True
+# Connection pool tuning
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "2"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100"))
+DB_ACQUIRE_TIMEOUT = float(os.getenv("DB_ACQUIRE_TIMEOUT", "10"))
+DB_COMMAND_TIMEOUT = float(os.getenv("DB_COMMAND_TIMEOUT", "30"))
+DB_MAX_IDLE_SECONDS = float(os.getenv("DB_MAX_IDLE_SECONDS", "300"))
 
-bot = commands.Bot(
+# User row cache
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "900"))
+
+# Events partitioning / retention (0 keeps raw events forever)
+EVENTS_PARTITIONS_AHEAD = int(os.getenv("EVENTS_PARTITIONS_AHEAD", "2"))
+EVENTS_RETENTION_DAYS = int(os.getenv("EVENTS_RETENTION_DAYS", "0"))
+
+# Write-behind buffer for $drink
+INGEST_FLUSH_SECONDS = float(os.getenv("INGEST_FLUSH_SECONDS", "2"))
+INGEST_FLUSH_SIZE = int(os.getenv("INGEST_FLUSH_SIZE", "500"))
+INGEST_JOURNAL_PATH = os.getenv("INGEST_JOURNAL_PATH", f"bumpy-ingest-{os.getenv('WORKER_INDEX', '0')}.journal")
+INGEST_FSYNC = os.getenv("INGEST_FSYNC", "1") == "1"
+
+# Reminder dispatch
+REMINDER_CONCURRENCY = int(os.getenv("REMINDER_CONCURRENCY", "8"))
+REMINDER_COALESCE = os.getenv("REMINDER_COALESCE", "0") == "1"
+# Reminders popped by a tick that hit a DB error are retried this much later
+REMINDER_RETRY_SECONDS = float(os.getenv("REMINDER_RETRY_SECONDS", "30"))
+# Each user's reminders land at their own fixed offset within this window, so
+# users who configured at the same time don't all fire on the same second.
+# Rounded down to a divisor of a minute, so whole-minute intervals keep the offset.
+REMINDER_JITTER_SECONDS = max(
+    (w for w in (1, 2, 3, 4, 5, 6, 10, 12, 15, 20, 30, 60) if w <= float(os.getenv("REMINDER_JITTER_SECONDS", "60"))),
+    default=0,
+)
+# Reminders found overdue at boot or on failover are released at most this fast (0 = all at once)
+REMINDER_CATCHUP_RATE = float(os.getenv("REMINDER_CATCHUP_RATE", "10"))
+
+# DM fallback delivery
+DM_CACHE_SIZE = int(os.getenv("DM_CACHE_SIZE", "5000"))
+DM_CLOSED_TTL = float(os.getenv("DM_CLOSED_TTL", "21600"))
+
+# Prometheus endpoint (0 disables it)
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
+
+# Outbound message dispatcher (Discord allows ~5 msgs / 5 s per channel, 50 req/s globally)
+OUTBOUND_WORKERS = int(os.getenv("OUTBOUND_WORKERS", "16"))
+OUTBOUND_GLOBAL_RATE = float(os.getenv("OUTBOUND_GLOBAL_RATE", "45"))
+OUTBOUND_CHANNEL_RATE = float(os.getenv("OUTBOUND_CHANNEL_RATE", "1"))
+OUTBOUND_CHANNEL_BURST = float(os.getenv("OUTBOUND_CHANNEL_BURST", "5"))
+
+# $export: gzip parts sized for Discord's upload limit, streamed off a dedicated connection
+EXPORT_PART_BYTES = int(os.getenv("EXPORT_PART_BYTES", str(8 * 2**20)))
+EXPORT_FETCH_ROWS = int(os.getenv("EXPORT_FETCH_ROWS", "1000"))
+EXPORT_CONCURRENCY = int(os.getenv("EXPORT_CONCURRENCY", "1"))
+EXPORT_COOLDOWN_SECONDS = float(os.getenv("EXPORT_COOLDOWN_SECONDS", "600"))
+
+# Multi-step commands ($config, $drink): live conversations and per-question timeout
+SESSION_MAX = int(os.getenv("SESSION_MAX", "1000"))
+SESSION_STEP_TIMEOUT = float(os.getenv("SESSION_STEP_TIMEOUT", "120"))
+
+# Log-channel echo digests (0 posts every echo immediately)
+LOG_DIGEST_SECONDS = float(os.getenv("LOG_DIGEST_SECONDS", "0"))
+LOG_DIGEST_MAX_LINES = int(os.getenv("LOG_DIGEST_MAX_LINES", "25"))
+
+# Scale-out: gateway sharding and reminder ownership across worker processes
+BOT_SHARDED = os.getenv("BOT_SHARDED", "0") == "1"
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "0")) or None
+SHARD_IDS = [int(s) for s in os.getenv("SHARD_IDS", "").split(",") if s.strip()] or None
+WORKER_INDEX = int(os.getenv("WORKER_INDEX", "0"))
+WORKER_COUNT = int(os.getenv("WORKER_COUNT", "1"))
+WORKER_ID = uuid.uuid4().hex
+REMINDER_PARTITIONS = int(os.getenv("REMINDER_PARTITIONS", "64"))
+LEASE_REFRESH_SECONDS = float(os.getenv("LEASE_REFRESH_SECONDS", "15"))
+LEASE_GRACE_SECONDS = float(os.getenv("LEASE_GRACE_SECONDS", "60"))
+USER_CHANGES_CHANNEL = "bumpy_users"
+
+# Unsharded, every worker receives every message: each $drink would be logged
+# and answered WORKER_COUNT times
+if WORKER_COUNT > 1 and not (BOT_SHARDED and SHARD_COUNT and SHARD_IDS):
+    raise SystemExit("WORKER_COUNT > 1 needs BOT_SHARDED=1, SHARD_COUNT and this worker's own SHARD_IDS")
+if not 0 <= WORKER_INDEX < WORKER_COUNT:
+    raise SystemExit(f"WORKER_INDEX must be in 0..{WORKER_COUNT - 1}")
+
+# Low-memory gateway mode: only the events and caches the commands need
+LOW_MEMORY = os.getenv("LOW_MEMORY", "0") == "1"
+MAX_MESSAGES = int(os.getenv("MAX_MESSAGES", "100" if LOW_MEMORY else "1000")) or None
+
+if LOW_MEMORY:
+    # Commands and their replies are all we read; no member list, presences,
+    # reactions, typing, voice etc. Authors still arrive with each message.
+    intents = discord.Intents.none()
+    intents.guilds = True
+    intents.guild_messages = True
+    intents.dm_messages = True
+    intents.message_content = True
+    cache_options = {
+        "member_cache_flags": discord.MemberCacheFlags.none(),
+        "chunk_guilds_at_startup": False,
+    }
+else:
+    intents = discord.Intents.default()
+    intents.message_content = True
+    intents.guilds = True
+    intents.members = True
+    cache_options = {}
+
+# Lets the outbound dispatcher see Discord's rate-limit headers on every response
+http_trace = aiohttp.TraceConfig()
+http_trace.on_request_end.append(lambda *args: _on_request_end(*args))
+
+shard_options = {"shard_count": SHARD_COUNT, "shard_ids": SHARD_IDS} if BOT_SHARDED else {}
+bot = (commands.AutoShardedBot if BOT_SHARDED else commands.Bot)(
     command_prefix="$",
     intents=intents,
     help_command=None,
-    allowed_mentions=discord.AllowedMentions(users=True, roles=True, everyone=False)
+    allowed_mentions=discord.AllowedMentions(users=True, roles=True, everyone=False),
+    http_trace=http_trace,
+    max_messages=MAX_MESSAGES,
+    **cache_options,
+    **shard_options
 )
 
+# ---------------- Metrics ----------------
+class Counter:
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self._values = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for key, value in self._values.items():
+            yield f"{self.name}{format_labels(key)} {value}"
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, buckets):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self._series = {}
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+        i = bisect.bisect_left(self.buckets, value)
+        if i < len(self.buckets):
+            series[0][i] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for key, (counts, total, count) in self._series.items():
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                yield f"{self.name}_bucket{format_labels(key + (('le', bound),))} {cumulative}"
+            yield f"{self.name}_bucket{format_labels(key + (('le', '+Inf'),))} {count}"
+            yield f"{self.name}_sum{format_labels(key)} {total}"
+            yield f"{self.name}_count{format_labels(key)} {count}"
+
+def format_labels(pairs) -> str:
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+@contextmanager
+def timed(histogram: Histogram, **labels):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.observe(time.perf_counter() - started, **labels)
+
+LOOP_TICK_SECONDS = Histogram(
+    "bumpy_loop_tick_seconds", "Time spent handling one wake-up of a background loop.",
+    (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300),
+)
+LOOP_OVERRUNS = Counter("bumpy_loop_overruns_total", "Ticks that took longer than the loop's budget.")
+REMINDER_LATENESS_SECONDS = Histogram(
+    "bumpy_reminder_lateness_seconds", "How long after next_reminder_at a reminder was picked up.",
+    (0.1, 0.5, 1, 2, 5, 10, 30, 60, 120, 300, 900, 3600),
+)
+DB_QUERY_SECONDS = Histogram(
+    "bumpy_db_query_seconds", "Database round trips by helper, including pool acquire.",
+    (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+SEND_SECONDS = Histogram(
+    "bumpy_send_seconds", "Discord message send latency by priority class.",
+    (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10),
+)
+SEND_FAILURES = Counter("bumpy_send_failures_total", "Discord sends that raised, by priority class and HTTP status.")
+METRICS = (LOOP_TICK_SECONDS, LOOP_OVERRUNS, REMINDER_LATENESS_SECONDS, DB_QUERY_SECONDS, SEND_SECONDS, SEND_FAILURES)
+
+def record_tick(loop: str, seconds: float, budget: float):
+    LOOP_TICK_SECONDS.observe(seconds, loop=loop)
+    if seconds > budget:
+        LOOP_OVERRUNS.inc(loop=loop)
+
+def render_gauges(prefix: str, stats: dict, labels=()):
+    for key, value in stats.items():
+        if isinstance(value, dict):
+            # {"sent": {"reminder": 3, ...}} -> bumpy_outbound_sent{priority="reminder"} 3
+            for sub, v in value.items():
+                yield f"bumpy_{prefix}_{key}{format_labels(labels + (('priority', sub),))} {v}"
+        else:
+            yield f"bumpy_{prefix}_{key}{format_labels(labels)} {value}"
+
+def render_metrics() -> str:
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    # Component stats are cheap dict snapshots, so they're read at scrape time only
+    for prefix, stats in (
+        ("db_pool", pool_stats()),
+        ("user_cache", user_cache.stats()),
+        ("dm_cache", dm_channels.stats()),
+        ("ingest", ingest.stats()),
+        ("log_digest", log_digest.stats()),
+        ("outbound", outbound.stats()),
+        ("sessions", sessions.stats()),
+        ("process", memory_stats()),
+    ):
+        lines.extend(render_gauges(prefix, stats))
+    lines.append(f"bumpy_reminders_scheduled {len(reminders)}")
+    lines.append(f"bumpy_reminder_partitions_owned {len(leases.owned)}")
+    return "\n".join(lines) + "\n"
+
+async def handle_metrics_request(reader, writer):
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), 5)
+        # Drain the headers; we don't need them
+        while (await asyncio.wait_for(reader.readline(), 5)) not in (b"\r\n", b"\n", b""):
+            pass
+        parts = request_line.decode("latin-1").split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+            status, body = "200 OK", render_metrics().encode()
+        else:
+            status, body = "404 Not Found", b"not found\n"
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+metrics_server = None
+
+async def start_metrics_server():
+    global metrics_server
+    if METRICS_PORT and metrics_server is None:
+        metrics_server = await asyncio.start_server(handle_metrics_request, METRICS_HOST, METRICS_PORT)
+        print(f"Metrics on http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+
 # ---------------- Database ----------------
-async def init_db():
-    conn = await asyncpg.connect(DATABASE_URL)
+db_pool = None
+db_stats = {
+    "acquires": 0,
+    "acquire_timeouts": 0,
+    "acquire_wait_total": 0.0,
+    "acquire_wait_max": 0.0,
+}
+
+# Transient failures a loop should log and retry rather than die on
+DB_ERRORS = (OSError, asyncio.TimeoutError, asyncpg.PostgresError, asyncpg.InterfaceError)
+
+async def init_pool():
+    """Create the shared connection pool once per process."""
+    global db_pool
+    if db_pool is None:
+        db_pool = await asyncpg.create_pool(
+            DATABASE_URL,
+            min_size=DB_POOL_MIN_SIZE,
+            max_size=DB_POOL_MAX_SIZE,
+            statement_cache_size=DB_STATEMENT_CACHE_SIZE,
+            command_timeout=DB_COMMAND_TIMEOUT,
+            max_inactive_connection_lifetime=DB_MAX_IDLE_SECONDS,
+        )
+    return db_pool
+
+@asynccontextmanager
+async def db():
+    """Borrow a pooled connection, tracking how long we waited for it."""
+    started = time.perf_counter()
+    try:
+        conn = await db_pool.acquire(timeout=DB_ACQUIRE_TIMEOUT)
+    except asyncio.TimeoutError:
+        db_stats["acquire_timeouts"] += 1
+        raise
+    waited = time.perf_counter() - started
+    db_stats["acquires"] += 1
+    db_stats["acquire_wait_total"] += waited
+    db_stats["acquire_wait_max"] = max(db_stats["acquire_wait_max"], waited)
+    try:
+        yield conn
+    finally:
+        await db_pool.release(conn)
+
+def pool_stats() -> dict:
+    if db_pool is None:
+        return {"size": 0, "idle": 0, "in_use": 0, "min": DB_POOL_MIN_SIZE, "max": DB_POOL_MAX_SIZE, **db_stats}
+    size = db_pool.get_size()
+    idle = db_pool.get_idle_size()
+    acquires = db_stats["acquires"]
+    return {
+        "size": size,
+        "idle": idle,
+        "in_use": size - idle,
+        "min": db_pool.get_min_size(),
+        "max": db_pool.get_max_size(),
+        "acquire_wait_avg": db_stats["acquire_wait_total"] / acquires if acquires else 0.0,
+        **db_stats,
+    }
+
+async def schema_base(conn):
     await conn.execute("""
     create table if not exists users (
       id bigint primary key,
@@ -50,62 +378,738 @@ async def init_db():
       primary key (user_id, date)
     );
     """)
+
+async def schema_reminders(conn):
+    # The code has always read interval_minutes; carry over anything only the
+    # original "interval" column had, then drop it so there's one source of truth
+    await conn.execute("alter table users add column if not exists interval_minutes int;")
+    await conn.execute("""
+    do $$
+    begin
+      if exists (select 1 from information_schema.columns
+                  where table_schema = current_schema() and table_name = 'users' and column_name = 'interval') then
+        update users set interval_minutes = "interval" where interval_minutes is null;
+        alter table users drop column "interval";
+      end if;
+    end $$;
+    """)
+    await conn.execute("alter table users add column if not exists next_reminder_at timestamptz;")
+    await conn.execute("create index if not exists users_next_reminder_at_idx on users (next_reminder_at);")
+    await conn.execute("create index if not exists users_timezone_idx on users ((coalesce(timezone, 'UTC')));")
+    await conn.execute("""
+    update users
+       set next_reminder_at = coalesce(last_reminder + make_interval(mins => interval_minutes), now())
+     where next_reminder_at is null and interval_minutes is not null;
+    """)
+
+async def schema_rollups(conn):
+    # Rollups maintained alongside daily_logs, plus goal streaks closed out at local midnight
+    await conn.execute("alter table users add column if not exists goal_streak int not null default 0;")
+    await conn.execute("alter table users add column if not exists best_goal_streak int not null default 0;")
+    await conn.execute("create index if not exists daily_logs_user_date_total_idx on daily_logs (user_id, date) include (total);")
+    for table, key, unit in (("weekly_logs", "week_start", "week"), ("monthly_logs", "month_start", "month")):
+        await conn.execute(f"""
+        create table if not exists {table} (
+          user_id bigint references users(id) on delete cascade,
+          {key} date not null,
+          total bigint not null,
+          days_logged int not null,
+          best_total int not null,
+          best_date date not null,
+          primary key (user_id, {key}) include (total, days_logged, best_total, best_date)
+        );
+        """)
+        await conn.execute(f"""
+        insert into {table} (user_id, {key}, total, days_logged, best_total, best_date)
+        select user_id, date_trunc('{unit}', date)::date, sum(total), count(*),
+               max(total), (array_agg(date order by total desc, date desc))[1]
+          from daily_logs
+         where not exists (select 1 from {table})
+         group by 1, 2;
+        """)
+
+async def schema_report_rollups(conn):
+    # Goal hits, worst day and hour-of-day intake per period, so $report reads
+    # a handful of rollup rows instead of aggregating daily_logs and events
+    for table, key, unit in (("weekly_logs", "week_start", "week"), ("monthly_logs", "month_start", "month")):
+        await conn.execute(f"""
+        alter table {table} add column if not exists goal_days int not null default 0;
+        alter table {table} add column if not exists worst_total int;
+        alter table {table} add column if not exists worst_date date;
+        """)
+        await conn.execute(f"""
+        update {table} r
+           set goal_days = s.goal_days, worst_total = s.worst_total, worst_date = s.worst_date
+          from (select l.user_id, date_trunc('{unit}', l.date)::date as period,
+                       count(*) filter (where l.total >= coalesce(u.daily_goal, 0)) as goal_days,
+                       min(l.total) as worst_total,
+                       (array_agg(l.date order by l.total, l.date desc))[1] as worst_date
+                  from daily_logs l join users u on u.id = l.user_id
+                 group by 1, 2) s
+         where r.user_id = s.user_id and r.{key} = s.period and r.worst_total is null;
+        """)
+        await conn.execute(f"""
+        alter table {table} drop constraint {table}_pkey;
+        alter table {table} add primary key (user_id, {key})
+          include (total, days_logged, best_total, best_date, goal_days, worst_total, worst_date);
+        """)
+    await conn.execute("""
+    create table if not exists hourly_profile (
+      user_id bigint references users(id) on delete cascade,
+      month_start date not null,
+      hour smallint not null,
+      amount bigint not null,
+      primary key (user_id, month_start, hour) include (amount)
+    );
+    """)
+    # Hours are local to the user's timezone at the time of the migration;
+    # from here on add_daily_totals records the local hour of each write
+    await conn.execute("""
+    insert into hourly_profile (user_id, month_start, hour, amount)
+    select e.user_id, date_trunc('month', e.ts at time zone coalesce(u.timezone, 'UTC'))::date,
+           extract(hour from e.ts at time zone coalesce(u.timezone, 'UTC')), sum(e.amount)
+      from (select user_id, ts, amount from events
+            union all
+            select user_id, hour, amount from events_hourly) e
+      join users u on u.id = e.user_id
+     where not exists (select 1 from hourly_profile)
+     group by 1, 2, 3;
+    """)
+
+def add_months(d: date, n: int) -> date:
+    """First day of the month n months after d's month."""
+    years, month = divmod(d.month - 1 + n, 12)
+    return date(d.year + years, month + 1, 1)
+
+async def partition_events(conn):
+    """Turn events into a table range-partitioned by month, migrating any
+    rows from the old unpartitioned table, and keep partitions created ahead."""
+    await conn.execute("""
+    do $$
+    begin
+      if exists (select 1 from pg_class where oid = to_regclass('events') and relkind = 'r') then
+        alter table events rename to events_unpartitioned;
+        alter table events_unpartitioned rename constraint events_pkey to events_unpartitioned_pkey;
+        alter sequence if exists events_id_seq rename to events_unpartitioned_id_seq;
+      end if;
+    end $$;
+    """)
     await conn.execute("""
     create table if not exists events (
-      id bigserial primary key,
+      id bigserial,
       user_id bigint references users(id) on delete cascade,
       ts timestamptz not null,
       amount int not null,
       unit text not null,
       kind text not null,
-      where_logged text
+      where_logged text,
+      primary key (id, ts)
+    ) partition by range (ts);
+    """)
+    await conn.execute("create index if not exists events_user_ts_idx on events (user_id, ts);")
+    # Set for $drink entries that went through the ingest journal, so replays are idempotent
+    await conn.execute("alter table events add column if not exists ingest_id uuid;")
+    await conn.execute("""
+    create table if not exists events_hourly (
+      user_id bigint references users(id) on delete cascade,
+      hour timestamptz not null,
+      kind text not null,
+      unit text not null,
+      amount bigint not null,
+      events int not null,
+      primary key (user_id, hour, kind, unit)
     );
     """)
-    await conn.close()
+
+    legacy = await conn.fetchval("select to_regclass('events_unpartitioned') is not null")
+    first_month = None
+    if legacy:
+        oldest = await conn.fetchval("select min(ts) from events_unpartitioned")
+        if oldest:
+            first_month = oldest.astimezone(timezone.utc).date().replace(day=1)
+    await ensure_event_partitions(conn, first_month)
+    # Catches anything outside the monthly ranges (e.g. clock skew) instead of failing the insert
+    await conn.execute("create table if not exists events_default partition of events default;")
+
+    if legacy:
+        async with conn.transaction():
+            await conn.execute("""
+                insert into events (id, user_id, ts, amount, unit, kind, where_logged)
+                select id, user_id, ts, amount, unit, kind, where_logged from events_unpartitioned;
+            """)
+            await conn.execute("""
+                select setval(pg_get_serial_sequence('events', 'id'), coalesce(max(id), 0) + 1, false) from events;
+            """)
+            await conn.execute("drop table events_unpartitioned;")
+
+async def ensure_event_partitions(conn, first_month: date | None = None):
+    this_month = datetime.now(timezone.utc).date().replace(day=1)
+    month = first_month or this_month
+    last = add_months(this_month, EVENTS_PARTITIONS_AHEAD)
+    while month <= last:
+        upper = add_months(month, 1)
+        try:
+            # Savepoint inside a migration's transaction, so one failure doesn't abort it
+            async with conn.transaction():
+                await conn.execute(f"""
+                    create table if not exists events_{month:%Y_%m} partition of events
+                    for values from ('{month} 00:00+00') to ('{upper} 00:00+00');
+                """)
+        except asyncpg.PostgresError as e:
+            # e.g. the default partition already holds rows for this month
+            print(f"Could not create events partition for {month:%Y-%m}: {e}")
+        month = upper
+
+# Append only; a deployed version number must never change meaning.
+# Each step is idempotent, so databases created before versioning adopt it cleanly.
+MIGRATIONS = (
+    (1, "users and daily_logs", schema_base),
+    (2, "reminder schedule columns", schema_reminders),
+    (3, "weekly/monthly rollups and goal streaks", schema_rollups),
+    (4, "monthly-partitioned events", partition_events),
+    (5, "goal, worst-day and hourly report rollups", schema_report_rollups),
+)
+MIGRATION_LOCK = 0x62756D72
+
+async def migrate():
+    """Apply pending MIGRATIONS in order, each in its own transaction and
+    recorded in schema_migrations. Workers starting together wait on an
+    advisory lock, so exactly one of them applies a given version.
+
+    Runs on its own connection without DB_COMMAND_TIMEOUT: backfills such as
+    the legacy events copy take as long as the table is big, and a worker
+    waiting on the lock has to outlast them."""
+    conn = await asyncpg.connect(DATABASE_URL, command_timeout=None, server_settings={"statement_timeout": "0"})
+    try:
+        await conn.execute("SELECT pg_advisory_lock($1, 0)", MIGRATION_LOCK)
+        try:
+            await conn.execute("""
+            create table if not exists schema_migrations (
+              version int primary key,
+              name text not null,
+              applied_at timestamptz not null default now()
+            );
+            """)
+            applied = {r["version"] for r in await conn.fetch("select version from schema_migrations")}
+            for version, name, step in MIGRATIONS:
+                if version in applied:
+                    continue
+                async with conn.transaction():
+                    await step(conn)
+                    await conn.execute(
+                        "insert into schema_migrations (version, name) values ($1, $2)", version, name
+                    )
+                print(f"Applied schema migration {version}: {name}")
+        finally:
+            await conn.execute("SELECT pg_advisory_unlock($1, 0)", MIGRATION_LOCK)
+    finally:
+        await conn.close()
+
+async def compact_events(conn):
+    """Fold raw events from partitions past the retention window into
+    events_hourly and drop them. Daily totals already live in daily_logs."""
+    if EVENTS_RETENTION_DAYS <= 0:
+        return
+    cutoff = datetime.now(timezone.utc) - timedelta(days=EVENTS_RETENTION_DAYS)
+    partitions = await conn.fetch("""
+        select c.relname from pg_inherits i join pg_class c on c.oid = i.inhrelid
+         where i.inhparent = 'events'::regclass
+    """)
+    for p in partitions:
+        m = re.fullmatch(r"events_(\d{4})_(\d{2})", p["relname"])
+        if not m:
+            continue
+        upper = add_months(date(int(m[1]), int(m[2]), 1), 1)
+        if datetime.combine(upper, datetime.min.time(), tzinfo=timezone.utc) > cutoff:
+            continue
+        async with conn.transaction():
+            await conn.execute(f"""
+                insert into events_hourly as h (user_id, hour, kind, unit, amount, events)
+                select user_id, date_trunc('hour', ts), kind, unit, sum(amount), count(*)
+                  from {p["relname"]}
+                 group by 1, 2, 3, 4
+                on conflict (user_id, hour, kind, unit) do update
+                set amount = h.amount + EXCLUDED.amount, events = h.events + EXCLUDED.events;
+            """)
+            await conn.execute(f"drop table {p['relname']};")
+        print(f"Compacted and dropped {p['relname']}")
+
+class UserCache:
+    """Bounded LRU of users rows keyed by Discord id, with a TTL as a backstop.
+    Every write to users goes through put(), so entries stay current; unknown
+    ids are cached as None until that user runs $config."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._rows = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    MISSING = object()
+
+    def get(self, uid):
+        """Return the cached row (possibly None), or UserCache.MISSING."""
+        entry = self._rows.get(uid)
+        if entry is None or entry[0] <= time.monotonic():
+            self.misses += 1
+            return self.MISSING
+        self.hits += 1
+        self._rows.move_to_end(uid)
+        return entry[1]
+
+    def put(self, uid, row):
+        self._rows[uid] = (time.monotonic() + self.ttl, row)
+        self._rows.move_to_end(uid)
+        while len(self._rows) > self.maxsize:
+            self._rows.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, uid):
+        self._rows.pop(uid, None)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._rows),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+user_cache = UserCache(USER_CACHE_SIZE, USER_CACHE_TTL)
 
 async def get_user(uid: int):
-    conn = await asyncpg.connect(DATABASE_URL)
-    user = await conn.fetchrow("SELECT * FROM users WHERE id=$1", uid)
-    await conn.close()
+    user = user_cache.get(uid)
+    if user is not UserCache.MISSING:
+        return user
+    with timed(DB_QUERY_SECONDS, helper="get_user"):
+        async with db() as conn:
+            user = await conn.fetchrow("SELECT * FROM users WHERE id=$1", uid)
+    user_cache.put(uid, user)
     return user
 
+async def get_users(uids):
+    """Resolve many users at once, hitting Postgres only for cache misses."""
+    found, missing = {}, []
+    for uid in uids:
+        user = user_cache.get(uid)
+        if user is UserCache.MISSING:
+            missing.append(uid)
+        else:
+            found[uid] = user
+    if missing:
+        with timed(DB_QUERY_SECONDS, helper="get_users"):
+            async with db() as conn:
+                rows = await conn.fetch("SELECT * FROM users WHERE id = ANY($1::bigint[])", missing)
+        for r in rows:
+            found[r["id"]] = r
+        for uid in missing:
+            user_cache.put(uid, found.get(uid))
+    return [found[uid] for uid in uids if found.get(uid)]
+
 async def upsert_user(uid: int, **kwargs):
-    conn = await asyncpg.connect(DATABASE_URL)
     fields = ", ".join([f"{k} = ${i+2}" for i, k in enumerate(kwargs.keys())])
     values = list(kwargs.values())
     query = f"""
         insert into users (id, {', '.join(kwargs.keys())})
         values ($1, {', '.join([f'${i+2}' for i in range(len(kwargs))])})
-        on conflict (id) do update set {fields};
+        on conflict (id) do update set {fields}
+        returning *;
     """
-    await conn.execute(query, uid, *values)
-    await conn.close()
+    with timed(DB_QUERY_SECONDS, helper="upsert_user"):
+        async with db() as conn:
+            row = await conn.fetchrow(query, uid, *values)
+    user_cache.put(uid, row)
+    return row
 
-async def log_event(uid: int, ts: datetime, amount: int, unit: str, kind: str, where: str):
-    conn = await asyncpg.connect(DATABASE_URL)
-    await conn.execute(
-        "insert into events (user_id, ts, amount, unit, kind, where_logged) values ($1,$2,$3,$4,$5,$6)",
-        uid, ts, amount, unit, kind, where
+async def insert_events(conn, rows):
+    """Bulk-load (user_id, ts, amount, unit, kind, where_logged, ingest_id) rows with COPY."""
+    await conn.copy_records_to_table(
+        "events",
+        records=rows,
+        columns=["user_id", "ts", "amount", "unit", "kind", "where_logged", "ingest_id"],
     )
-    await conn.close()
 
-async def add_daily_total(uid: int, date, amount: int):
-    conn = await asyncpg.connect(DATABASE_URL)
-    await conn.execute("""
+def _rollup_upsert(table: str, key: str, unit: str) -> str:
+    # Day totals only ever grow, so the running max per period stays exact and
+    # a day counts towards goal_days once, when it first reaches the goal. The
+    # minimum only has to be looked for again when the worst day itself grew;
+    # then it's the lowest of this batch's days and the period's other days.
+    return f"""
+        insert into {table} as r (user_id, {key}, total, days_logged, best_total, best_date,
+                                  goal_days, worst_total, worst_date)
+        select d.user_id, date_trunc('{unit}', d.date)::date, sum(i.amount),
+               count(*) filter (where d.is_new), max(d.total),
+               (array_agg(d.date order by d.total desc, d.date desc))[1],
+               count(*) filter (where d.total >= coalesce(u.daily_goal, 0)
+                                  and (d.is_new or d.total - i.amount < coalesce(u.daily_goal, 0))),
+               min(d.total), (array_agg(d.date order by d.total, d.date desc))[1]
+          from day d join inc i using (user_id, date) join users u on u.id = d.user_id
+         group by 1, 2
+        on conflict (user_id, {key}) do update
+        set total = r.total + EXCLUDED.total,
+            days_logged = r.days_logged + EXCLUDED.days_logged,
+            best_date = case when EXCLUDED.best_total > r.best_total then EXCLUDED.best_date else r.best_date end,
+            best_total = greatest(r.best_total, EXCLUDED.best_total),
+            goal_days = r.goal_days + EXCLUDED.goal_days,
+            (worst_total, worst_date) = (
+                select c.total, c.date from (
+                    select EXCLUDED.worst_total, EXCLUDED.worst_date
+                    union all
+                    select r.worst_total, r.worst_date
+                     where not exists (select 1 from inc where user_id = r.user_id and date = r.worst_date)
+                    union all
+                    select l.total, l.date from daily_logs l
+                     where exists (select 1 from inc where user_id = r.user_id and date = r.worst_date)
+                       and l.user_id = r.user_id
+                       and l.date >= r.{key} and l.date < r.{key} + interval '1 {unit}'
+                       and not exists (select 1 from inc where user_id = l.user_id and date = l.date)
+                ) as c(total, date)
+                order by c.total, c.date desc limit 1
+            )
+    """
+
+ADD_DAILY_TOTALS_SQL = f"""
+    with raw as (
+        select * from unnest($1::bigint[], $2::date[], $3::int[], $4::int[]) as t(user_id, date, hour, amount)
+    ), inc as (
+        select user_id, date, sum(amount)::int as amount from raw group by user_id, date
+    ), hours as (
+        insert into hourly_profile as h (user_id, month_start, hour, amount)
+        select user_id, date_trunc('month', date)::date, hour, sum(amount) from raw group by 1, 2, 3
+        on conflict (user_id, month_start, hour) do update
+        set amount = h.amount + EXCLUDED.amount
+    ), day as (
         insert into daily_logs (user_id, date, total)
-        values ($1, $2, $3)
+        select user_id, date, amount from inc
         on conflict (user_id, date) do update
         set total = daily_logs.total + EXCLUDED.total
-    """, uid, date, amount)
-    await conn.close()
+        returning user_id, date, total, (xmax = 0) as is_new
+    ), week as (
+        {_rollup_upsert("weekly_logs", "week_start", "week")}
+    )
+    {_rollup_upsert("monthly_logs", "month_start", "month")}
+"""
+
+async def add_daily_totals(conn, rows):
+    """Apply many (user_id, local_ts, amount) increments to daily_logs, its
+    weekly/monthly rollups and the hourly profile in one statement. Must run
+    inside a transaction."""
+    uids, stamps, amounts = zip(*rows)
+    # The worst-day recompute reads daily_logs from the statement's snapshot, so a
+    # concurrent write for the same user has to commit first. NO KEY UPDATE, in id
+    # order, doesn't conflict with the key-share locks the events inserts took.
+    await conn.execute(
+        "SELECT 1 FROM users WHERE id = ANY($1::bigint[]) ORDER BY id FOR NO KEY UPDATE", sorted(set(uids))
+    )
+    await conn.execute(
+        ADD_DAILY_TOTALS_SQL, list(uids), [ts.date() for ts in stamps], [ts.hour for ts in stamps], list(amounts)
+    )
+
+# ---------------- Ingest ----------------
+# Failures caused by an entry's own data (out-of-range amount, deleted user);
+# retrying them can never succeed, unlike the transient DB_ERRORS
+INGEST_REJECTED = (ValueError, OverflowError, asyncpg.DataError, asyncpg.IntegrityConstraintViolationError)
+
+class IngestBuffer:
+    """Write-behind buffer for $drink logs. Each entry is appended to a local
+    journal before the user is acknowledged, then entries are written to
+    Postgres in periodic batches. Entries still in the journal at startup are
+    replayed; ones whose ingest_id already reached events are skipped.
+    Concurrent adds share one fsync, run off the event loop."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._pending = []
+        self._totals = {}
+        self._journal = None
+        self._lock = asyncio.Lock()
+        self._flush_task = None
+        self._written = 0
+        self._synced = 0
+        self._sync_task = None
+        self.flushes = 0
+        self.flushed_entries = 0
+        self.failed_flushes = 0
+        self.rejected_entries = 0
+
+    def __len__(self):
+        return len(self._pending)
+
+    def open(self):
+        if self._journal is not None:
+            return
+        if os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        self._track(json.loads(line))
+                    except ValueError:
+                        # A torn final line from a crash mid-write was never acknowledged
+                        continue
+        self._rewrite()
+
+    def _track(self, entry: dict):
+        self._pending.append(entry)
+        key = (entry["uid"], entry["date"])
+        self._totals[key] = self._totals.get(key, 0) + entry["amount"]
+
+    async def add(self, uid: int, ts: datetime, amount: int, unit: str, kind: str, where: str):
+        entry = {
+            "id": str(uuid.uuid4()),
+            "uid": uid,
+            "ts": ts.isoformat(),
+            "date": ts.date().isoformat(),
+            "amount": amount,
+            "unit": unit,
+            "kind": kind,
+            "where": where,
+        }
+        self._journal.write(json.dumps(entry) + "\n")
+        self._journal.flush()
+        self._written += 1
+        self._track(entry)
+        if len(self._pending) >= INGEST_FLUSH_SIZE and not self._lock.locked():
+            self._flush_task = asyncio.create_task(self.flush())
+        if INGEST_FSYNC:
+            await self._sync(self._written)
+
+    async def _sync(self, upto: int):
+        """Wait until the journal is on disk through write number `upto`. Each
+        fsync covers every write made before it started, so the $drinks that
+        arrive while one is running are all covered by the next."""
+        while self._synced < upto:
+            if self._sync_task is None:
+                self._sync_task = asyncio.create_task(self._fsync())
+            await asyncio.shield(self._sync_task)
+
+    async def _fsync(self):
+        upto = self._written
+        # A dup stays valid if _compact swaps the journal meanwhile; the copy is fsynced itself
+        fd = os.dup(self._journal.fileno())
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, os.fsync, fd)
+        finally:
+            os.close(fd)
+            self._sync_task = None
+        self._synced = max(self._synced, upto)
+
+    def pending_total(self, uid: int, day: date) -> int:
+        return self._totals.get((uid, day.isoformat()), 0)
+
+    async def recover(self):
+        """Drop replayed entries that were committed before the journal was trimmed."""
+        if not self._pending:
+            return
+        async with db() as conn:
+            rows = await conn.fetch("""
+                SELECT ingest_id FROM events
+                 WHERE user_id = ANY($1::bigint[]) AND ts >= $2 AND ingest_id = ANY($3::uuid[])
+            """,
+                list({e["uid"] for e in self._pending}),
+                min(datetime.fromisoformat(e["ts"]) for e in self._pending),
+                [uuid.UUID(e["id"]) for e in self._pending],
+            )
+        done = {str(r["ingest_id"]) for r in rows}
+        if done:
+            async with self._lock:
+                self._settle([e for e in self._pending if e["id"] in done])
+                await self._compact()
+        await self.flush()
+
+    async def flush(self):
+        async with self._lock:
+            batch = list(self._pending)
+            if not batch:
+                return
+            try:
+                try:
+                    await self._write(batch)
+                except INGEST_REJECTED:
+                    # Something in the batch can never be written; set it aside, keep the rest
+                    written = await self._write_each(batch)
+                else:
+                    self._settle(batch)
+                    written = batch
+            except DB_ERRORS as e:
+                # Entries stay journaled and pending; the next flush retries them
+                self.failed_flushes += 1
+                print(f"Ingest flush of {len(batch)} entries failed: {e}")
+                return
+            self.flushes += 1
+            self.flushed_entries += len(written)
+            try:
+                await self._compact()
+            except OSError as e:
+                # Settled entries left in the journal are skipped by recover() on restart
+                print(f"Ingest journal compaction failed: {e}")
+
+    async def _write(self, batch):
+        with timed(DB_QUERY_SECONDS, helper="ingest_flush"):
+            async with db() as conn:
+                async with conn.transaction():
+                    await insert_events(conn, [
+                        (e["uid"], datetime.fromisoformat(e["ts"]), e["amount"], e["unit"],
+                         e["kind"], e["where"], uuid.UUID(e["id"]))
+                        for e in batch
+                    ])
+                    await add_daily_totals(conn, [
+                        (e["uid"], datetime.fromisoformat(e["ts"]), e["amount"]) for e in batch
+                    ])
+
+    async def _write_each(self, batch) -> list:
+        """Write entries one at a time, moving the ones rejected for their own
+        data to the .rejected file. Returns the entries that were written."""
+        written, rejected = [], []
+        try:
+            for entry in batch:
+                try:
+                    await self._write([entry])
+                except INGEST_REJECTED as e:
+                    print(f"Ingest entry {entry['id']} for {entry['uid']} rejected: {e!r}")
+                    rejected.append(dict(entry, error=repr(e)))
+                else:
+                    written.append(entry)
+        finally:
+            # Also on a DB error part way through, so nothing is written twice
+            if rejected:
+                with open(self.path + ".rejected", "a", encoding="utf-8") as f:
+                    f.writelines(json.dumps(e) + "\n" for e in rejected)
+                self.rejected_entries += len(rejected)
+            self._settle(written + rejected)
+        return written
+
+    def _settle(self, entries):
+        ids = {e["id"] for e in entries}
+        self._pending = [e for e in self._pending if e["id"] not in ids]
+        for e in entries:
+            key = (e["uid"], e["date"])
+            self._totals[key] -= e["amount"]
+            if not self._totals[key]:
+                del self._totals[key]
+
+    async def _compact(self):
+        """Replace the journal with just the still-pending entries. The copy
+        is fsynced off the event loop; entries added meanwhile are appended
+        and synced too, and the swap itself doesn't await, so none is lost."""
+        tmp = self.path + ".tmp"
+        loop = asyncio.get_running_loop()
+        copied = set()
+        with open(tmp, "w", encoding="utf-8") as f:
+            while True:
+                fresh = [e for e in self._pending if e["id"] not in copied]
+                if copied and not fresh:
+                    break
+                f.writelines(json.dumps(e) + "\n" for e in fresh)
+                f.flush()
+                copied.update(e["id"] for e in fresh)
+                await loop.run_in_executor(None, os.fsync, f.fileno())
+                if not fresh:
+                    break
+        self._journal.close()
+        os.replace(tmp, self.path)
+        self._journal = open(self.path, "a", encoding="utf-8")
+
+    def _rewrite(self):
+        """Atomically replace the journal with just the still-pending entries."""
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.writelines(json.dumps(e) + "\n" for e in self._pending)
+            f.flush()
+            os.fsync(f.fileno())
+        if self._journal is not None:
+            self._journal.close()
+        os.replace(tmp, self.path)
+        self._journal = open(self.path, "a", encoding="utf-8")
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._pending),
+            "flushes": self.flushes,
+            "flushed_entries": self.flushed_entries,
+            "failed_flushes": self.failed_flushes,
+            "rejected_entries": self.rejected_entries,
+        }
+
+ingest = IngestBuffer(INGEST_JOURNAL_PATH)
 
 # ---------------- Helpers ----------------
-def tz_now(tz_name: str) -> datetime:
+def rss_mb() -> float | None:
+    """Current resident memory of this process, where /proc is available."""
     try:
-        tz = pytz.timezone(tz_name)
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def memory_stats() -> dict:
+    return {
+        "rss_mb": rss_mb() or 0.0,
+        "guilds": len(bot.guilds),
+        "members_cached": sum(len(g.members) for g in bot.guilds),
+        "messages_cached": len(bot.cached_messages),
+    }
+
+def log_memory(when: str):
+    stats = memory_stats()
+    rss = f"{stats['rss_mb']:.1f} MiB" if stats["rss_mb"] else "n/a"
+    print(
+        f"Memory {when}: rss={rss} guilds={stats['guilds']} members_cached={stats['members_cached']} "
+        f"messages_cached={stats['messages_cached']} (low-memory mode {'on' if LOW_MEMORY else 'off'})"
+    )
+
+@functools.lru_cache(maxsize=1024)
+def get_tz(tz_name: str):
+    """Resolved once per name; unknown or empty names fall back to UTC."""
+    try:
+        return pytz.timezone(tz_name)
     except Exception:
-        tz = pytz.UTC
-    return datetime.now(tz)
+        return pytz.UTC
+
+def tz_now(tz_name: str) -> datetime:
+    return datetime.now(get_tz(tz_name))
+
+class LocalClock:
+    """One tick's "now", converted once per distinct timezone instead of once
+    per user, so everyone handled in a tick shares the same local time and date."""
+
+    def __init__(self, now_utc: datetime):
+        self.now_utc = now_utc
+        self._local = {}
+
+    def now(self, tz_name: str | None) -> datetime:
+        tz_name = tz_name or "UTC"
+        local = self._local.get(tz_name)
+        if local is None:
+            local = self._local[tz_name] = self.now_utc.astimezone(get_tz(tz_name))
+        return local
+
+    def today(self, tz_name: str | None) -> date:
+        return self.now(tz_name).date()
+
+def next_local_midnight(tz_name: str, now_utc: datetime) -> datetime:
+    """The UTC instant at which tz_name's next local day starts."""
+    tz = get_tz(tz_name)
+    tomorrow = now_utc.astimezone(tz).date() + timedelta(days=1)
+    return tz.localize(datetime.combine(tomorrow, datetime.min.time())).astimezone(timezone.utc)
+
+def chunk_lines(items, render, header: str = "", limit: int = 2000):
+    """Split items into groups whose rendered lines, joined under header,
+    fit in one Discord message."""
+    chunk, size = [], len(header)
+    for item in items:
+        line_len = len(render(item)) + 1
+        if chunk and size + line_len > limit:
+            yield chunk
+            chunk, size = [], len(header)
+        chunk.append(item)
+        size += line_len
+    if chunk:
+        yield chunk
 
 def convert_goal(unit_choice: int, number: int):
     """Convert chosen unit to base oz/ml."""
@@ -158,24 +1162,769 @@ def timezone_choice(choice: int, custom: str | None = None) -> str:
             return "UTC"
     return "UTC"
 
+# ---------------- Scheduling ----------------
+class DeadlineScheduler:
+    """Min-heap of per-key deadlines. Rescheduling a key leaves its old heap
+    entry behind; stale entries are skipped lazily when they reach the top."""
+
+    def __init__(self):
+        self._heap = []
+        self._deadlines = {}
+        self._wakeup = asyncio.Event()
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def __contains__(self, key):
+        return key in self._deadlines
+
+    def schedule(self, key, when: datetime):
+        ts = when.timestamp()
+        self._deadlines[key] = ts
+        heapq.heappush(self._heap, (ts, key))
+        if len(self._heap) > 2 * len(self._deadlines) + 64:
+            self._heap = [(t, k) for k, t in self._deadlines.items()]
+            heapq.heapify(self._heap)
+        self._wakeup.set()
+
+    def remove(self, key):
+        self._deadlines.pop(key, None)
+
+    def keys(self):
+        return list(self._deadlines)
+
+    def deadline(self, key) -> float | None:
+        return self._deadlines.get(key)
+
+    def peek(self) -> float | None:
+        while self._heap:
+            ts, key = self._heap[0]
+            if self._deadlines.get(key) == ts:
+                return ts
+            heapq.heappop(self._heap)
+        return None
+
+    def pop_due(self, now: datetime) -> list:
+        """Remove and return (key, deadline_ts) for everything due at `now`."""
+        cutoff = now.timestamp()
+        due = []
+        while True:
+            ts = self.peek()
+            if ts is None or ts > cutoff:
+                return due
+            _, key = heapq.heappop(self._heap)
+            del self._deadlines[key]
+            due.append((key, ts))
+
+    async def wait(self):
+        """Sleep until the earliest deadline, or until something is (re)scheduled."""
+        self._wakeup.clear()
+        ts = self.peek()
+        timeout = None if ts is None else max(0.0, ts - time.time())
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+reminders = DeadlineScheduler()
+midnights = DeadlineScheduler()
+# Held by a reminder tick from pop_due through persist_reminders
+reminder_tick = asyncio.Lock()
+
+def reminder_phase(uid: int) -> float:
+    """Stable per-user offset in [0, REMINDER_JITTER_SECONDS)."""
+    return zlib.crc32(uid.to_bytes(8, "little")) / 2**32 * REMINDER_JITTER_SECONDS
+
+def smooth_deadline(uid: int, target: datetime) -> datetime:
+    """Move target to this user's slot within the jitter window it falls in.
+    Applying it twice changes nothing, and since intervals are whole minutes
+    a user keeps the same phase from one reminder to the next."""
+    if REMINDER_JITTER_SECONDS <= 0:
+        return target
+    ts = target.timestamp()
+    return datetime.fromtimestamp(ts - ts % REMINDER_JITTER_SECONDS + reminder_phase(uid), timezone.utc)
+
+def next_reminder_at(u, now_utc: datetime) -> datetime:
+    due = smooth_deadline(u["id"], now_utc + timedelta(minutes=u["interval_minutes"]))
+    # Smoothing moves a deadline less than one window, so one step is enough never to refire at once
+    return due if due > now_utc else due + timedelta(seconds=REMINDER_JITTER_SECONDS)
+
+async def load_reminder_schedule(partitions):
+    """Schedule every reminder in these partitions and warm the user cache
+    with the soonest-due rows, all from one query."""
+    with timed(DB_QUERY_SECONDS, helper="load_reminder_schedule"):
+        async with db() as conn:
+            rows = await conn.fetch("""
+                SELECT * FROM users
+                WHERE interval_minutes IS NOT NULL AND daily_goal IS NOT NULL
+                  AND ((id >> 22) % $1) = ANY($2::int[])
+                ORDER BY next_reminder_at NULLS FIRST
+            """, REMINDER_PARTITIONS, list(partitions))
+    now_utc = datetime.now(timezone.utc)
+    overdue = 0
+    for r in rows:
+        due = smooth_deadline(r["id"], r["next_reminder_at"] or now_utc)
+        if due <= now_utc and REMINDER_CATCHUP_RATE > 0:
+            # Came due while nobody was sending; rows are most-overdue first
+            due = now_utc + timedelta(seconds=overdue / REMINDER_CATCHUP_RATE)
+            overdue += 1
+        reminders.schedule(r["id"], due)
+        tz = r["timezone"] or "UTC"
+        if tz not in midnights:
+            midnights.schedule(tz, next_local_midnight(tz, now_utc))
+    # Soonest-due go in last, so they're the last the LRU would evict
+    for r in reversed(rows[:user_cache.maxsize]):
+        user_cache.put(r["id"], r)
+
+def track_user(uid: int, row):
+    """Bring the local schedules in line with a freshly written users row."""
+    if row and row["interval_minutes"] and row["daily_goal"] and leases.owns(uid):
+        reminders.schedule(uid, row["next_reminder_at"])
+    else:
+        reminders.remove(uid)
+    tz = (row and row["timezone"]) or "UTC"
+    if tz not in midnights:
+        midnights.schedule(tz, next_local_midnight(tz, datetime.now(timezone.utc)))
+
+async def reschedule_reminder(uid: int):
+    # Just written by upsert_user, so this is a cache hit
+    user = await get_user(uid)
+    next_at = datetime.now(timezone.utc)
+    if user["last_reminder"] and user["interval_minutes"]:
+        next_at = user["last_reminder"] + timedelta(minutes=user["interval_minutes"])
+    with timed(DB_QUERY_SECONDS, helper="reschedule_reminder"):
+        async with db() as conn:
+            row = await conn.fetchrow(
+                "UPDATE users SET next_reminder_at = $2 WHERE id=$1 RETURNING *",
+                uid, smooth_deadline(uid, next_at)
+            )
+            # Other workers drop their cached copy and, if they own this user, reschedule
+            await conn.execute("SELECT pg_notify($1, $2)", USER_CHANGES_CHANNEL, f"{WORKER_ID}:{uid}")
+    user_cache.put(uid, row)
+    track_user(uid, row)
+
+# ---------------- Scale-out ----------------
+def user_partition(uid: int) -> int:
+    # Bits 22+ of a snowflake are its creation time in ms, which spreads evenly
+    return (uid >> 22) % REMINDER_PARTITIONS
+
+class PartitionLeases:
+    """Ownership of reminder partitions via Postgres session advisory locks,
+    held on a dedicated connection (pooled connections unlock on release).
+    A worker first claims only its preferred partitions; after the grace
+    period it also claims any nobody holds, so a crashed worker's users are
+    picked up. When a preferred owner is back, borrowed partitions are handed
+    back to it. The same session holds this worker's index and gateway shards,
+    so a second process configured with either of them is turned away."""
+
+    PARTITION_LOCKS = 0x62756D70  # "bump"
+    WORKER_LOCKS = 0x62756D71
+    SHARD_LOCKS = 0x62756D73
+
+    def __init__(self):
+        self.owned = set()
+        self._conn = None
+        self._started = time.monotonic()
+
+    def owns(self, uid: int) -> bool:
+        return user_partition(uid) in self.owned
+
+    def preferred(self, partition: int) -> int:
+        return partition % WORKER_COUNT
+
+    @property
+    def connected(self) -> bool:
+        return self._conn is not None and not self._conn.is_closed()
+
+    async def _connect(self) -> str | None:
+        """Open the lease session. Returns what another session already holds
+        instead, if anything; closing ours drops whatever it took meanwhile."""
+        conn = await asyncpg.connect(DATABASE_URL)
+        try:
+            held = None
+            if not await conn.fetchval("SELECT pg_try_advisory_lock($1, $2)", self.WORKER_LOCKS, WORKER_INDEX):
+                held = f"worker index {WORKER_INDEX}"
+            elif SHARD_IDS:
+                taken = await conn.fetch(
+                    "SELECT s FROM unnest($2::int[]) AS s WHERE NOT pg_try_advisory_lock($1, s)",
+                    self.SHARD_LOCKS, SHARD_IDS
+                )
+                if taken:
+                    held = "shard " + ", ".join(str(r["s"]) for r in taken)
+            if held is None:
+                await conn.add_listener(USER_CHANGES_CHANNEL, on_user_changed)
+        except BaseException:
+            conn.terminate()
+            raise
+        if held is not None:
+            await conn.close()
+            return held
+        self._conn = conn
+        return None
+
+    async def refresh(self):
+        """Returns (gained, lost) partition sets since the previous refresh."""
+        try:
+            if not self.connected:
+                lost, self.owned = self.owned, set()
+                self._conn = None
+                held = await self._connect()
+                if held:
+                    # A second process with our config, or our own old session Postgres hasn't reaped yet
+                    print(f"Leases not taken: {held} is held by another session; retrying in {LEASE_REFRESH_SECONDS:g}s")
+                    return set(), lost
+            else:
+                lost = set()
+
+            # Hand borrowed partitions back to preferred owners that are alive again
+            borrowed = sorted(p for p in self.owned if self.preferred(p) != WORKER_INDEX)
+            if borrowed:
+                alive = await self._conn.fetch("""
+                    SELECT w FROM unnest($2::int[]) AS w
+                     WHERE CASE WHEN pg_try_advisory_lock($1, w) THEN NOT pg_advisory_unlock($1, w) ELSE true END
+                """, self.WORKER_LOCKS, sorted({self.preferred(p) for p in borrowed}))
+                alive = {r["w"] for r in alive}
+                returning = [p for p in borrowed if self.preferred(p) in alive]
+                if returning:
+                    # The new owner loads next_reminder_at from the users table, so a
+                    # tick still sending from these partitions has to persist first.
+                    # Writes that failed wait for the next tick; keep those partitions.
+                    async with reminder_tick:
+                        unsaved = {user_partition(entry[0]) for entry in unsaved_reminders}
+                        returning = [p for p in returning if p not in unsaved]
+                        if returning:
+                            await self._conn.execute(
+                                "SELECT pg_advisory_unlock($1, p) FROM unnest($2::int[]) AS p",
+                                self.PARTITION_LOCKS, returning
+                            )
+                            self.owned.difference_update(returning)
+                            lost.update(returning)
+
+            wanted = [
+                p for p in range(REMINDER_PARTITIONS)
+                # Not what was just handed back: its preferred owner takes it on its own refresh
+                if p not in self.owned and p not in lost and (
+                    self.preferred(p) == WORKER_INDEX
+                    or time.monotonic() - self._started >= LEASE_GRACE_SECONDS
+                )
+            ]
+            gained = set()
+            if wanted:
+                rows = await self._conn.fetch(
+                    "SELECT p FROM unnest($2::int[]) AS p WHERE pg_try_advisory_lock($1, p)",
+                    self.PARTITION_LOCKS, wanted
+                )
+                gained = {r["p"] for r in rows}
+                self.owned.update(gained)
+            return gained, lost
+        except (OSError, asyncio.TimeoutError, asyncpg.PostgresError, asyncpg.InterfaceError) as e:
+            # Without the session our locks are gone too; stop sending until we re-acquire
+            print(f"Lease refresh failed: {e}")
+            if self.connected:
+                self._conn.terminate()
+            self._conn = None
+            lost, self.owned = self.owned, set()
+            return set(), lost
+
+    async def release(self, partitions):
+        self.owned.difference_update(partitions)
+        try:
+            await self._conn.execute(
+                "SELECT pg_advisory_unlock($1, p) FROM unnest($2::int[]) AS p",
+                self.PARTITION_LOCKS, sorted(partitions)
+            )
+        except DB_ERRORS as e:
+            # Ending the session drops every lock; the next refresh reconnects
+            print(f"Releasing reminder partitions failed: {e}")
+            if self.connected:
+                self._conn.terminate()
+
+leases = PartitionLeases()
+
+async def refresh_leases():
+    gained, lost = await leases.refresh()
+    if lost:
+        for uid in [uid for uid in reminders.keys() if user_partition(uid) in lost]:
+            reminders.remove(uid)
+    if gained:
+        try:
+            await load_reminder_schedule(gained)
+        except DB_ERRORS as e:
+            # Held but unscheduled, their users would never be reminded; let them
+            # go so this or another worker claims and loads them again
+            print(f"Loading reminder partitions failed: {e!r}; releasing {len(gained)}")
+            await leases.release(gained)
+            gained = set()
+    if gained:
+        # Close out any days the previous owner didn't get to
+        now_utc = datetime.now(timezone.utc)
+        for tz_name in midnights.keys():
+            midnights.schedule(tz_name, now_utc)
+    if gained or lost:
+        print(f"Worker {WORKER_INDEX} owns {len(leases.owned)}/{REMINDER_PARTITIONS} reminder partitions")
+
+def on_user_changed(conn, pid, channel, payload):
+    worker, _, uid = payload.partition(":")
+    if worker == WORKER_ID:
+        return
+    uid = int(uid)
+    user_cache.invalidate(uid)
+    if leases.owns(uid):
+        asyncio.get_running_loop().create_task(_reload_user(uid))
+
+async def _reload_user(uid: int):
+    track_user(uid, await get_user(uid))
+
+# ---------------- Delivery ----------------
+PRIORITY_INTERACTIVE, PRIORITY_REMINDER, PRIORITY_SUMMARY, PRIORITY_LOG = range(4)
+PRIORITY_NAMES = ("interactive", "reminder", "summary", "log")
+CHANNEL_ROUTE = re.compile(r"/channels/(\d+)/")
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def delay(self) -> float:
+        """Seconds until a token is available (0 if one is available now)."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        wait = (1 - self.tokens) / self.rate if self.tokens < 1 else 0.0
+        return max(wait, self.blocked_until - now)
+
+    def take(self):
+        self.tokens -= 1
+
+    def block(self, seconds: float):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+class OutboundDispatcher:
+    """Single path for every message the bot sends. Each channel has its own
+    backlog ordered by priority (interactive > reminders > summaries > log
+    echoes), then by arrival; at most one message per channel is in flight, so
+    a channel sees its messages in order. Channels whose token bucket (or the
+    global one) is empty are parked on a timer instead of holding a worker,
+    so one throttled channel can't delay replies elsewhere. Buckets are also
+    pushed back by Discord's own rate-limit headers (see on_http_response)."""
+
+    def __init__(self, workers: int, global_rate: float, route_rate: float, route_burst: float):
+        self.workers = workers
+        self.route_rate = route_rate
+        self.route_burst = route_burst
+        self._ready = asyncio.PriorityQueue()
+        self._seq = itertools.count()
+        self._tasks = []
+        self._detached = set()
+        self._backlog = {}
+        self._routes = OrderedDict()
+        self._global = TokenBucket(global_rate, global_rate)
+        self.queued = [0] * len(PRIORITY_NAMES)
+        self.sent = [0] * len(PRIORITY_NAMES)
+        self.failed = [0] * len(PRIORITY_NAMES)
+        self.wait_total = [0.0] * len(PRIORITY_NAMES)
+        self.wait_max = [0.0] * len(PRIORITY_NAMES)
+        self.throttled = 0
+        self.rate_limited = 0
+
+    def _bucket(self, route: int) -> TokenBucket:
+        bucket = self._routes.get(route)
+        if bucket is None:
+            bucket = self._routes[route] = TokenBucket(self.route_rate, self.route_burst)
+            # Idle channels' buckets are full anyway, so old ones can be forgotten
+            if len(self._routes) > 10000:
+                self._routes.popitem(last=False)
+        else:
+            self._routes.move_to_end(route)
+        return bucket
+
+    def _ready_route(self, route: int):
+        priority, seq = self._backlog[route][0][:2]
+        self._ready.put_nowait((priority, seq, route))
+
+    async def send(self, target, *args, priority: int = PRIORITY_INTERACTIVE, **kwargs):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        route = getattr(target, "channel", target).id
+        fut = asyncio.get_running_loop().create_future()
+        self.queued[priority] += 1
+        item = (priority, next(self._seq), time.monotonic(), target, args, kwargs, fut)
+        backlog = self._backlog.get(route)
+        if backlog is None:
+            self._backlog[route] = [item]
+            self._ready_route(route)
+        else:
+            # The route already has a ticket in flight; it picks this up in turn
+            heapq.heappush(backlog, item)
+        return await fut
+
+    def send_nowait(self, target, *args, priority: int, **kwargs):
+        """Queue a message without waiting for delivery; a failure is only logged."""
+        task = asyncio.create_task(self._send_logged(target, args, priority, kwargs))
+        self._detached.add(task)
+        task.add_done_callback(self._detached.discard)
+
+    async def _send_logged(self, target, args, priority: int, kwargs):
+        try:
+            await self.send(target, *args, priority=priority, **kwargs)
+        except discord.HTTPException as e:
+            route = getattr(target, "channel", target).id
+            print(f"{PRIORITY_NAMES[priority].capitalize()} message to {route} failed: {e}")
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            _, _, route = await self._ready.get()
+            delay = max(self._bucket(route).delay(), self._global.delay())
+            if delay > 0:
+                self.throttled += 1
+                loop.call_later(delay, self._ready_route, route)
+                continue
+            self._bucket(route).take()
+            self._global.take()
+
+            backlog = self._backlog[route]
+            priority, _, queued_at, target, args, kwargs, fut = heapq.heappop(backlog)
+            self.queued[priority] -= 1
+            if not fut.cancelled():
+                waited = time.monotonic() - queued_at
+                self.wait_total[priority] += waited
+                self.wait_max[priority] = max(self.wait_max[priority], waited)
+                started = time.perf_counter()
+                try:
+                    result = await target.send(*args, **kwargs)
+                except Exception as e:
+                    self.failed[priority] += 1
+                    SEND_FAILURES.inc(priority=PRIORITY_NAMES[priority], status=getattr(e, "status", "error"))
+                    if not fut.cancelled():
+                        fut.set_exception(e)
+                else:
+                    SEND_SECONDS.observe(time.perf_counter() - started, priority=PRIORITY_NAMES[priority])
+                    self.sent[priority] += 1
+                    if not fut.cancelled():
+                        fut.set_result(result)
+
+            if backlog:
+                self._ready_route(route)
+            else:
+                del self._backlog[route]
+
+    def on_http_response(self, path: str, status: int, headers):
+        retry_after = headers.get("Retry-After")
+        if status == 429:
+            self.rate_limited += 1
+            if headers.get("X-RateLimit-Global") and retry_after:
+                self._global.block(float(retry_after))
+        m = CHANNEL_ROUTE.search(path)
+        if not m:
+            return
+        route = int(m.group(1))
+        reset_after = headers.get("X-RateLimit-Reset-After")
+        if status == 429 and retry_after:
+            self._bucket(route).block(float(retry_after))
+        elif headers.get("X-RateLimit-Remaining") == "0" and reset_after:
+            self._bucket(route).block(float(reset_after))
+
+    def stats(self) -> dict:
+        return {
+            "depth": {name: self.queued[p] for p, name in enumerate(PRIORITY_NAMES)},
+            "sent": {name: self.sent[p] for p, name in enumerate(PRIORITY_NAMES)},
+            "failed": {name: self.failed[p] for p, name in enumerate(PRIORITY_NAMES)},
+            "wait_avg": {
+                name: self.wait_total[p] / self.sent[p] if self.sent[p] else 0.0
+                for p, name in enumerate(PRIORITY_NAMES)
+            },
+            "wait_max": {name: self.wait_max[p] for p, name in enumerate(PRIORITY_NAMES)},
+            "throttled": self.throttled,
+            "rate_limited": self.rate_limited,
+        }
+
+outbound = OutboundDispatcher(OUTBOUND_WORKERS, OUTBOUND_GLOBAL_RATE, OUTBOUND_CHANNEL_RATE, OUTBOUND_CHANNEL_BURST)
+
+async def _on_request_end(session, trace_ctx, params):
+    outbound.on_http_response(params.url.path, params.response.status, params.response.headers)
+
+class DMChannelCache:
+    """Bounded LRU of resolved DM channels, so a DM reminder is one send
+    instead of fetch_user + send. Users whose DMs are closed (403) are
+    remembered for a while and skipped without any API call."""
+
+    def __init__(self, maxsize: int, closed_ttl: float):
+        self.maxsize = maxsize
+        self.closed_ttl = closed_ttl
+        self._channels = OrderedDict()
+        self._closed = {}
+        self.hits = 0
+        self.misses = 0
+        self.skipped = 0
+
+    def put(self, uid: int, channel):
+        self._channels[uid] = channel
+        self._channels.move_to_end(uid)
+        while len(self._channels) > self.maxsize:
+            self._channels.popitem(last=False)
+
+    def warm(self, client):
+        # DM channels the gateway already gave us cost nothing to reuse
+        for ch in client.private_channels:
+            if isinstance(ch, discord.DMChannel) and ch.recipient:
+                self.put(ch.recipient.id, ch)
+
+    def is_closed(self, uid: int) -> bool:
+        expires = self._closed.get(uid)
+        if expires is None:
+            return False
+        if expires <= time.monotonic():
+            del self._closed[uid]
+            return False
+        return True
+
+    def mark_closed(self, uid: int):
+        self._closed[uid] = time.monotonic() + self.closed_ttl
+        self._channels.pop(uid, None)
+
+    async def resolve(self, uid: int):
+        channel = self._channels.get(uid)
+        if channel is not None:
+            self.hits += 1
+            self._channels.move_to_end(uid)
+            return channel
+        self.misses += 1
+        user = bot.get_user(uid)
+        channel = user.dm_channel if user else None
+        if channel is None:
+            channel = await bot.create_dm(discord.Object(id=uid))
+        self.put(uid, channel)
+        return channel
+
+    async def send(self, uid: int, content: str) -> bool:
+        """DM a user; False if their DMs are known closed or just turned out to be."""
+        if self.is_closed(uid):
+            self.skipped += 1
+            return False
+        try:
+            channel = await self.resolve(uid)
+            await outbound.send(channel, content, priority=PRIORITY_REMINDER)
+        except (discord.Forbidden, discord.NotFound):
+            self.mark_closed(uid)
+            return False
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._channels),
+            "closed": len(self._closed),
+            "hits": self.hits,
+            "misses": self.misses,
+            "skipped": self.skipped,
+        }
+
+dm_channels = DMChannelCache(DM_CACHE_SIZE, DM_CLOSED_TTL)
+
+class LogDigest:
+    """Batches log-channel echoes per channel and posts them as one message
+    every LOG_DIGEST_SECONDS, or sooner once a channel has LOG_DIGEST_MAX_LINES
+    queued. Lines stay plain message content so coach role pings still fire."""
+
+    def __init__(self, interval: float, max_lines: int):
+        self.interval = interval
+        self.max_lines = max_lines
+        self._buffers = {}
+        self._locks = {}
+        self._tasks = set()
+        self.echoes = 0
+        self.messages = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.interval > 0
+
+    async def post(self, channel, line: str):
+        self.echoes += 1
+        if not self.enabled:
+            self.messages += 1
+            await outbound.send(channel, line, priority=PRIORITY_LOG)
+            return
+        channel_id = channel.id
+        buffered = self._buffers.setdefault(channel_id, (channel, []))[1]
+        buffered.append(line)
+        if len(buffered) >= self.max_lines:
+            await self.flush_channel(channel_id)
+
+    def post_nowait(self, channel, line: str):
+        """post() in the background, so the caller never waits behind the log
+        channel's rate limit; failures are only logged."""
+        task = asyncio.create_task(self._post_logged(channel, line))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _post_logged(self, channel, line: str):
+        try:
+            await self.post(channel, line)
+        except discord.HTTPException as e:
+            print(f"Log echo to {channel.id} failed: {e}")
+
+    async def flush_channel(self, channel_id: int):
+        # Per-channel lock keeps digests in order when a size flush races the timer
+        async with self._locks.setdefault(channel_id, asyncio.Lock()):
+            channel, lines = self._buffers.pop(channel_id, (None, []))
+            for chunk in chunk_lines(lines, lambda line: line):
+                self.messages += 1
+                try:
+                    await outbound.send(channel, "\n".join(chunk), priority=PRIORITY_LOG)
+                except discord.HTTPException as e:
+                    print(f"Log digest to {channel_id} failed: {e}")
+
+    async def flush(self):
+        for channel_id in list(self._buffers):
+            await self.flush_channel(channel_id)
+
+    def stats(self) -> dict:
+        return {
+            "pending": sum(len(lines) for _, lines in self._buffers.values()),
+            "echoes": self.echoes,
+            "messages": self.messages,
+            "api_calls_saved": self.echoes - self.messages,
+        }
+
+log_digest = LogDigest(LOG_DIGEST_SECONDS, LOG_DIGEST_MAX_LINES)
+
+# ---------------- Conversations ----------------
+class SessionClosed(Exception):
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+class Session:
+    def __init__(self, router, key):
+        self.router = router
+        self.key = key
+        self.closed = None
+        self._inbox = deque(maxlen=5)
+        self._waiter = None
+
+    def deliver(self, message):
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(message)
+        else:
+            # Answered before we finished asking; picked up by the next reply()
+            self._inbox.append(message)
+
+    def close(self, reason: str):
+        self.closed = reason
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_exception(SessionClosed(reason))
+
+    async def reply(self, timeout: float | None = None):
+        """Next message from this author in this channel. Raises
+        asyncio.TimeoutError if none comes in time, SessionClosed if the
+        conversation was replaced or evicted meanwhile."""
+        if self.closed:
+            raise SessionClosed(self.closed)
+        if self._inbox:
+            return self._inbox.popleft()
+        self._waiter = asyncio.get_running_loop().create_future()
+        try:
+            return await asyncio.wait_for(self._waiter, timeout or self.router.step_timeout)
+        finally:
+            self._waiter = None
+            self.router.touch(self.key)
+
+class SessionRouter:
+    """Routes replies to multi-step commands by (author, channel) with one
+    dict lookup per message, instead of a wait_for listener per pending
+    question that every message has to be checked against. Every question
+    times out, starting a command again replaces the old conversation, and
+    past SESSION_MAX the least recently active one is evicted."""
+
+    def __init__(self, max_sessions: int, step_timeout: float):
+        self.max_sessions = max_sessions
+        self.step_timeout = step_timeout
+        self._sessions = OrderedDict()
+        self.opened = 0
+        self.routed = 0
+        self.replaced = 0
+        self.evicted = 0
+
+    def open(self, author_id: int, channel_id: int) -> Session:
+        key = (author_id, channel_id)
+        old = self._sessions.pop(key, None)
+        if old is not None:
+            self.replaced += 1
+            old.close("replaced")
+        while len(self._sessions) >= self.max_sessions:
+            _, stale = self._sessions.popitem(last=False)
+            self.evicted += 1
+            stale.close("evicted")
+        session = self._sessions[key] = Session(self, key)
+        self.opened += 1
+        return session
+
+    def close(self, session: Session):
+        if self._sessions.get(session.key) is session:
+            del self._sessions[session.key]
+        session.closed = session.closed or "done"
+
+    def touch(self, key):
+        if key in self._sessions:
+            self._sessions.move_to_end(key)
+
+    def feed(self, message) -> bool:
+        """Hand a message to its conversation; True if it was one."""
+        session = self._sessions.get((message.author.id, message.channel.id))
+        if session is None:
+            return False
+        self.routed += 1
+        self.touch(session.key)
+        session.deliver(message)
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "live": len(self._sessions),
+            "opened": self.opened,
+            "routed": self.routed,
+            "replaced": self.replaced,
+            "evicted": self.evicted,
+        }
+
+sessions = SessionRouter(SESSION_MAX, SESSION_STEP_TIMEOUT)
+
+async def converse(ctx, command: str, steps):
+    """Run a command's question-and-answer steps in its own session."""
+    session = sessions.open(ctx.author.id, ctx.channel.id)
+    try:
+        await steps(ctx, session)
+    except asyncio.TimeoutError:
+        await outbound.send(ctx, f"⏰ No answer in time. Run `${command}` again when you're ready.")
+    except SessionClosed as e:
+        if e.reason == "evicted":
+            await outbound.send(ctx, f"⚠️ Too many open conversations, so this one was closed. Run `${command}` again.")
+    finally:
+        sessions.close(session)
+
 # ---------------- Commands ----------------
 @bot.command(name="config")
 async def config(ctx):
-    def check(m): return m.author == ctx.author and m.channel == ctx.channel
+    await converse(ctx, "config", config_steps)
 
+async def config_steps(ctx, session):
     # Name
-    await ctx.send("👋 What should I call you?")
-    name = (await bot.wait_for("message", check=check)).content.strip()
+    await outbound.send(ctx, "👋 What should I call you?")
+    name = (await session.reply()).content.strip()
 
     # Age
-    await ctx.send("📅 How old are you?")
+    await outbound.send(ctx, "📅 How old are you?")
     try:
-        age = int((await bot.wait_for("message", check=check)).content.strip())
-    except:
-        return await ctx.send("❌ Invalid number for age. Run `$config` again.")
+        age = int((await session.reply()).content.strip())
+    except ValueError:
+        return await outbound.send(ctx, "❌ Invalid number for age. Run `$config` again.")
 
     # Daily goal unit selection with conversion
-    await ctx.send(
+    await outbound.send(ctx,
         "💧 Choose the unit for your daily goal:\n"
         "1) Ounces (oz)\n"
         "2) Cups (8 oz)\n"
@@ -185,22 +1934,22 @@ async def config(ctx):
         "6) Liters (1000 ml)"
     )
     try:
-        unit_choice = int((await bot.wait_for("message", check=check)).content.strip())
-    except:
-        return await ctx.send("❌ Invalid choice. Run `$config` again.")
+        unit_choice = int((await session.reply()).content.strip())
+    except ValueError:
+        return await outbound.send(ctx, "❌ Invalid choice. Run `$config` again.")
 
-    await ctx.send("📊 Enter the number for your **daily goal** in that unit (e.g., `8` cups, `2` liters):")
+    await outbound.send(ctx, "📊 Enter the number for your **daily goal** in that unit (e.g., `8` cups, `2` liters):")
     try:
-        num = int((await bot.wait_for("message", check=check)).content.strip())
-    except:
-        return await ctx.send("❌ Invalid number. Run `$config` again.")
+        num = int((await session.reply()).content.strip())
+    except ValueError:
+        return await outbound.send(ctx, "❌ Invalid number. Run `$config` again.")
 
     daily_goal, base_unit = convert_goal(unit_choice, num)
     if not daily_goal:
-        return await ctx.send("❌ Invalid unit selection. Run `$config` again.")
+        return await outbound.send(ctx, "❌ Invalid unit selection. Run `$config` again.")
 
     # Interval picker
-    await ctx.send(
+    await outbound.send(ctx,
         "⏱ Choose your reminder interval:\n"
         "1) every 15 minutes\n"
         "2) every 30 minutes\n"
@@ -212,22 +1961,22 @@ async def config(ctx):
         "8) custom (enter minutes)"
     )
     try:
-        interval_choice = int((await bot.wait_for("message", check=check)).content.strip())
-    except:
-        return await ctx.send("❌ Invalid choice. Run `$config` again.")
+        interval_choice = int((await session.reply()).content.strip())
+    except ValueError:
+        return await outbound.send(ctx, "❌ Invalid choice. Run `$config` again.")
     custom_minutes = None
     if interval_choice == 8:
-        await ctx.send("⌨️ Enter custom interval in minutes (e.g., `75`):")
+        await outbound.send(ctx, "⌨️ Enter custom interval in minutes (e.g., `75`):")
         try:
-            custom_minutes = int((await bot.wait_for("message", check=check)).content.strip())
-        except:
-            return await ctx.send("❌ Invalid minutes. Run `$config` again.")
+            custom_minutes = int((await session.reply()).content.strip())
+        except ValueError:
+            return await outbound.send(ctx, "❌ Invalid minutes. Run `$config` again.")
     interval = interval_choice_to_minutes(interval_choice, custom_minutes)
     if not interval:
-        return await ctx.send("❌ Interval not recognized. Run `$config` again.")
+        return await outbound.send(ctx, "❌ Interval not recognized. Run `$config` again.")
 
     # Timezone picker
-    await ctx.send(
+    await outbound.send(ctx,
         "🌍 Choose your timezone:\n"
         "1) EST (America/New_York)\n"
         "2) CST (America/Chicago)\n"
@@ -237,61 +1986,66 @@ async def config(ctx):
         "6) Custom (type your own; e.g., Europe/London)"
     )
     try:
-        tz_choice = int((await bot.wait_for("message", check=check)).content.strip())
-    except:
-        return await ctx.send("❌ Invalid choice. Run `$config` again.")
+        tz_choice = int((await session.reply()).content.strip())
+    except ValueError:
+        return await outbound.send(ctx, "❌ Invalid choice. Run `$config` again.")
     tz_custom = None
     if tz_choice == 6:
-        await ctx.send("⌨️ Enter your timezone (e.g., `Europe/London`):")
-        tz_custom = (await bot.wait_for("message", check=check)).content.strip()
+        await outbound.send(ctx, "⌨️ Enter your timezone (e.g., `Europe/London`):")
+        tz_custom = (await session.reply()).content.strip()
     tz = timezone_choice(tz_choice, tz_custom)
 
     # Channels
-    await ctx.send("🔔 Mention **reminder** channel (#channel)")
-    reminder_msg = await bot.wait_for("message", check=check)
+    await outbound.send(ctx, "🔔 Mention **reminder** channel (#channel)")
+    reminder_msg = await session.reply()
     reminder_channel = reminder_msg.channel_mentions[0].id if reminder_msg.channel_mentions else None
 
-    await ctx.send("📜 Mention **log** channel (#channel)")
-    log_msg = await bot.wait_for("message", check=check)
+    await outbound.send(ctx, "📜 Mention **log** channel (#channel)")
+    log_msg = await session.reply()
     log_channel = log_msg.channel_mentions[0].id if log_msg.channel_mentions else None
 
     # Self-ping
-    await ctx.send("👤 Ping yourself on reminders? (yes/no)")
-    ping_self = (await bot.wait_for("message", check=check)).content.strip().lower() in ["yes","y","true","1"]
+    await outbound.send(ctx, "👤 Ping yourself on reminders? (yes/no)")
+    ping_self = (await session.reply()).content.strip().lower() in ["yes","y","true","1"]
 
     # Coach setup (FIXED)
-    await ctx.send("👥 Enable coach pings? (yes/no)")
-    coach_enable = (await bot.wait_for("message", check=check)).content.strip().lower() in ["yes","y","true","1"]
+    await outbound.send(ctx, "👥 Enable coach pings? (yes/no)")
+    coach_enable = (await session.reply()).content.strip().lower() in ["yes","y","true","1"]
 
     coach_role_id = None
     coach_ping_logs = False
     coach_ping_reminders = False
     if coach_enable:
-        roles = [r for r in ctx.guild.roles if not r.is_default()]
+        if ctx.guild is None:
+            roles = []
+        elif LOW_MEMORY:
+            # Fetched on demand rather than trusting a trimmed gateway cache
+            roles = sorted((r for r in await ctx.guild.fetch_roles() if not r.is_default()), key=lambda r: r.position)
+        else:
+            roles = [r for r in ctx.guild.roles if not r.is_default()]
         if not roles:
-            await ctx.send("ℹ️ No selectable roles found; skipping coach role.")
+            await outbound.send(ctx, "ℹ️ No selectable roles found; skipping coach role.")
         else:
             show = roles[:20]
             listing = "\n".join([f"{i+1}. {r.mention}" for i, r in enumerate(show)])
-            await ctx.send(f"Select a coach role (type the **number**):\n{listing}")
+            await outbound.send(ctx, f"Select a coach role (type the **number**):\n{listing}")
             try:
-                choice = int((await bot.wait_for("message", check=check)).content.strip())
+                choice = int((await session.reply()).content.strip())
                 coach_role_id = show[choice-1].id
-            except Exception:
-                await ctx.send("❌ Invalid selection. Skipping coach role.")
+            except (ValueError, IndexError):
+                await outbound.send(ctx, "❌ Invalid selection. Skipping coach role.")
                 coach_role_id = None
     if coach_role_id:
-        await ctx.send("📜 Ping coach role in **daily logs**? (yes/no)")
-        coach_ping_logs = (await bot.wait_for("message", check=check)).content.strip().lower() in ["yes","y","true","1"]
+        await outbound.send(ctx, "📜 Ping coach role in **daily logs**? (yes/no)")
+        coach_ping_logs = (await session.reply()).content.strip().lower() in ["yes","y","true","1"]
 
-        await ctx.send("🔔 Ping coach role in **reminders**? (yes/no)")
-        import asyncio
+        await outbound.send(ctx, "🔔 Ping coach role in **reminders**? (yes/no)")
         try:
-            reply = await bot.wait_for("message", check=check, timeout=60)
+            reply = await session.reply(timeout=60)
             coach_ping_reminders = reply.content.strip().lower() in ["yes","y","true","1"]
-            await ctx.send(f"✅ Coach role reminders set to {coach_ping_reminders}")
+            await outbound.send(ctx, f"✅ Coach role reminders set to {coach_ping_reminders}")
         except asyncio.TimeoutError:
-            await ctx.send("⏳ No answer received, skipping coach reminder pings.")
+            await outbound.send(ctx, "⏳ No answer received, skipping coach reminder pings.")
             coach_ping_reminders = False
 
     # Save config
@@ -311,42 +2065,49 @@ async def config(ctx):
         coach_ping_reminders=coach_ping_reminders,
         last_reset=tz_now(tz).date()
     )
-    await ctx.send(f"✅ Config saved! Daily goal = {daily_goal} {base_unit} • Every {interval} min • TZ: {tz}")
+    await reschedule_reminder(ctx.author.id)
+    await outbound.send(ctx, f"✅ Config saved! Daily goal = {daily_goal} {base_unit} • Every {interval} min • TZ: {tz}")
 
 # --- DRINK COMMAND ---
 @bot.command(name="drink", aliases=["Drink", "DRINK", "dRiNk"])
 async def drink(ctx):
-    def check(m):
-        return m.author == ctx.author and m.channel == ctx.channel
+    await converse(ctx, "drink", drink_steps)
+
+# Largest single $drink accepted, in the unit it's logged in (about 5 l)
+DRINK_MAX_AMOUNT = {"ml": 5000, "oz": 170}
 
+async def drink_steps(ctx, session):
     # Step 1: Ask for unit
-    await ctx.send("💧 What unit are you logging in? (oz/ml)")
+    await outbound.send(ctx, "💧 What unit are you logging in? (oz/ml)")
     try:
-        unit_msg = await bot.wait_for("message", check=check, timeout=30.0)
+        unit_msg = await session.reply(timeout=30.0)
         log_unit = unit_msg.content.lower()
         if log_unit not in ["oz", "ml"]:
-            await ctx.send("❌ Please choose either 'oz' or 'ml'.")
+            await outbound.send(ctx, "❌ Please choose either 'oz' or 'ml'.")
             return
     except asyncio.TimeoutError:
-        await ctx.send("⏰ You didn’t respond with a unit in time. Try again with `$drink`.")
+        await outbound.send(ctx, "⏰ You didn’t respond with a unit in time. Try again with `$drink`.")
         return
 
     # Step 2: Ask for amount
-    await ctx.send(f"💧 How many {log_unit}?")
+    await outbound.send(ctx, f"💧 How many {log_unit}?")
     try:
-        amt_msg = await bot.wait_for("message", check=check, timeout=30.0)
+        amt_msg = await session.reply(timeout=30.0)
         log_amount = int(amt_msg.content)
     except asyncio.TimeoutError:
-        await ctx.send("⏰ You didn’t respond with an amount in time. Try again with `$drink`.")
+        await outbound.send(ctx, "⏰ You didn’t respond with an amount in time. Try again with `$drink`.")
         return
     except ValueError:
-        await ctx.send("❌ That wasn’t a valid number.")
+        await outbound.send(ctx, "❌ That wasn’t a valid number.")
+        return
+    if not 0 < log_amount <= DRINK_MAX_AMOUNT[log_unit]:
+        await outbound.send(ctx, f"❌ Please enter an amount between 1 and {DRINK_MAX_AMOUNT[log_unit]} {log_unit}.")
         return
 
     # Step 3: Confirm + log to DB
     user = await get_user(ctx.author.id)
     if not user:
-        return await ctx.send("Run `$config` first.")
+        return await outbound.send(ctx, "Run `$config` first.")
 
     config_unit = user.get("unit", "ml")  # default to ml
     amount = log_amount
@@ -370,69 +2131,319 @@ async def drink(ctx):
             display_extra = f"(≈ {round(log_amount * 0.033814)} oz)"
 
     now_local = tz_now(user["timezone"] or "UTC")
-    await log_event(ctx.author.id, now_local, amount, final_unit, "manual", str(ctx.channel.id))
-    await add_daily_total(ctx.author.id, now_local.date(), amount)
+    # Journaled locally right away; the DB write happens in the next batched flush
+    await ingest.add(ctx.author.id, now_local, amount, final_unit, "manual", str(ctx.channel.id))
 
     confirmation = f"✅ Logged {log_amount} {log_unit} {display_extra}"
-    await ctx.send(confirmation)
+    await outbound.send(ctx, confirmation)
 
     # Optional: send to log channel if configured
-    if user.get("log_channel_id"):
-        log_channel = bot.get_channel(user["log_channel_id"])
+    if user["log_channel"]:
+        log_channel = bot.get_channel(user["log_channel"])
         if log_channel:
             msg = f"📒 {ctx.author.display_name} logged {log_amount} {log_unit} {display_extra} at {now_local.strftime('%H:%M')}."
-            if user.get("coach_ping_logs") and user.get("coach_role_id"):
-                msg += f" <@&{user['coach_role_id']}>"
-            await log_channel.send(msg)
+            if user["coach_ping_logs"] and user["coach_role"]:
+                msg += f" <@&{user['coach_role']}>"
+            await log_digest.post(log_channel, msg)
 
 @bot.command(name="check")
 async def check(ctx):
     user = await get_user(ctx.author.id)
     if not user:
-        return await ctx.send("Run `$config` first.")
-    conn = await asyncpg.connect(DATABASE_URL)
+        return await outbound.send(ctx, "Run `$config` first.")
     today = tz_now(user["timezone"]).date()
-    row = await conn.fetchrow(
-        "SELECT total FROM daily_logs WHERE user_id=$1 AND date=$2",
-        ctx.author.id, today
-    )
-    await conn.close()
-    total = row["total"] if row else 0
+    with timed(DB_QUERY_SECONDS, helper="check"):
+        async with db() as conn:
+            row = await conn.fetchrow(
+                "SELECT total FROM daily_logs WHERE user_id=$1 AND date=$2",
+                ctx.author.id, today
+            )
+    total = (row["total"] if row else 0) + ingest.pending_total(ctx.author.id, today)
     pct = (total / user["daily_goal"] * 100) if user["daily_goal"] else 0
-    await ctx.send(f"💧 Progress: {total}/{user['daily_goal']} {user['unit']} ({pct:.1f}%) today.")
+    await outbound.send(ctx, f"💧 Progress: {total}/{user['daily_goal']} {user['unit']} ({pct:.1f}%) today.")
+
+REPORT_SPANS = {"week": 7, "month": 30, "quarter": 90, "year": 365, "all": None}
+SPARK_BARS = "▁▂▃▄▅▆▇█"
+
+# One round trip per report: whole months come from monthly_logs and
+# hourly_profile, and only the partial month at the start of the range reads
+# daily_logs and raw events (or their compacted events_hourly history), so the
+# work is bounded by one month plus one rollup row per month in the range.
+REPORT_SQL = """
+    WITH head AS (
+        SELECT date, total FROM daily_logs
+         WHERE user_id = $1 AND date >= $2 AND date < $3
+    ), months AS (
+        SELECT total, days_logged, goal_days, best_total, best_date, worst_total, worst_date
+          FROM monthly_logs
+         WHERE user_id = $1 AND month_start >= $3
+    ), best AS (
+        SELECT date, total FROM head
+        UNION ALL
+        SELECT best_date, best_total FROM months
+        ORDER BY total DESC, date DESC LIMIT 1
+    ), worst AS (
+        SELECT date, total FROM head
+        UNION ALL
+        SELECT worst_date, worst_total FROM months
+        ORDER BY total, date DESC LIMIT 1
+    ), best_week AS (
+        SELECT week_start, total FROM weekly_logs
+         WHERE user_id = $1 AND week_start >= $2
+         ORDER BY total DESC, week_start DESC LIMIT 1
+    ), hours AS (
+        SELECT hour, sum(amount)::bigint AS amount
+          FROM (
+              SELECT hour, amount FROM hourly_profile WHERE user_id = $1 AND month_start >= $3
+              UNION ALL
+              SELECT extract(hour FROM ts AT TIME ZONE $5)::int, amount FROM events
+               WHERE user_id = $1 AND ts >= $6 AND ts < $3::timestamp AT TIME ZONE $5
+              UNION ALL
+              SELECT extract(hour FROM hour AT TIME ZONE $5)::int, amount FROM events_hourly
+               WHERE user_id = $1 AND hour >= $6 AND hour < $3::timestamp AT TIME ZONE $5
+          ) AS e
+         GROUP BY 1
+    )
+    SELECT (SELECT coalesce(sum(total), 0) FROM head)
+             + (SELECT coalesce(sum(total), 0) FROM months) AS total,
+           (SELECT count(*) FROM head)
+             + (SELECT coalesce(sum(days_logged), 0) FROM months) AS days_logged,
+           (SELECT count(*) FROM head WHERE total >= $4)
+             + (SELECT coalesce(sum(goal_days), 0) FROM months) AS goal_days,
+           b.date AS best_date, b.total AS best_total,
+           w.date AS worst_date, w.total AS worst_total,
+           bw.week_start AS best_week, bw.total AS best_week_total,
+           (SELECT array_agg(hour ORDER BY hour) FROM hours) AS hours,
+           (SELECT array_agg(amount ORDER BY hour) FROM hours) AS hour_amounts
+      FROM (SELECT 1) AS one
+      LEFT JOIN best b ON true
+      LEFT JOIN worst w ON true
+      LEFT JOIN best_week bw ON true
+"""
+
+def parse_report_span(span: str):
+    """Turn `7`, `90d`, `year`, `all`, ... into (days, label); days=None means all time."""
+    span = span.strip().lower()
+    if span in REPORT_SPANS:
+        days = REPORT_SPANS[span]
+    else:
+        try:
+            days = int(span.rstrip("d"))
+        except ValueError:
+            return None, None
+        if not 1 <= days <= 3660:
+            return None, None
+    return days, ("All-time" if days is None else f"{days}-day")
+
+def hourly_sparkline(hours, amounts) -> str:
+    by_hour = dict(zip(hours or [], amounts or []))
+    peak = max(by_hour.values(), default=0)
+    if not peak:
+        return ""
+    return "".join(
+        SPARK_BARS[min(len(SPARK_BARS) - 1, by_hour.get(h, 0) * len(SPARK_BARS) // peak)] if by_hour.get(h) else " "
+        for h in range(24)
+    )
 
 @bot.command(name="report")
-async def report(ctx, days: int = 7):
+async def report(ctx, span: str = "7"):
     user = await get_user(ctx.author.id)
     if not user:
-        return await ctx.send("Run `$config` first.")
-    if days not in (7, 15, 30):
-        days = 7
-    conn = await asyncpg.connect(DATABASE_URL)
-    rows = await conn.fetch(
-        "SELECT date,total FROM daily_logs WHERE user_id=$1 ORDER BY date DESC LIMIT $2",
-        ctx.author.id, days
-    )
-    await conn.close()
-    if not rows:
-        return await ctx.send("No logs yet.")
-    totals = [r["total"] for r in rows]
-    avg = sum(totals) / len(totals)
-    best = max(rows, key=lambda r: r["total"])
-    worst = min(rows, key=lambda r: r["total"])
-    msg = (
-        f"📊 {days}-day report:\n"
-        f"• Average: {avg:.1f} {user['unit']}/day\n"
-        f"• Best: {best['total']} on {best['date']}\n"
-        f"• Worst: {worst['total']} on {worst['date']}"
+        return await outbound.send(ctx, "Run `$config` first.")
+    days, label = parse_report_span(span)
+    if not label:
+        days, label = 7, "7-day"
+
+    tz_name = user["timezone"] or "UTC"
+    today = tz_now(tz_name).date()
+    start = today - timedelta(days=days - 1) if days else date(1970, 1, 1)
+    first_full_month = start if start.day == 1 else add_months(start, 1)
+    start_ts = get_tz(tz_name).localize(datetime.combine(start, datetime.min.time()))
+
+    with timed(DB_QUERY_SECONDS, helper="report"):
+        async with db() as conn:
+            r = await conn.fetchrow(
+                REPORT_SQL, ctx.author.id, start, first_full_month,
+                user["daily_goal"] or 0, tz_name, start_ts
+            )
+    if not r["days_logged"]:
+        return await outbound.send(ctx, "No logs yet.")
+    avg = r["total"] / r["days_logged"]
+    lines = [
+        f"📊 {label} report:",
+        f"• Average: {avg:.1f} {user['unit']}/day over {r['days_logged']} logged days",
+        f"• Best: {r['best_total']} on {r['best_date']}",
+        f"• Worst: {r['worst_total']} on {r['worst_date']}",
+        f"• Goal hit: {r['goal_days']} days • Streak: {user['goal_streak']} (best {user['best_goal_streak']})",
+    ]
+    if r["best_week"]:
+        lines.append(f"• Best week: {r['best_week_total']} {user['unit']} from {r['best_week']}")
+    spark = hourly_sparkline(r["hours"], r["hour_amounts"])
+    if spark:
+        peak_hour = r["hours"][r["hour_amounts"].index(max(r["hour_amounts"]))]
+        lines.append(f"• By hour (00→23): `{spark}` peak {peak_hour:02d}:00")
+    await outbound.send(ctx, "\n".join(lines))
+
+EXPORT_FORMATS = ("csv", "jsonl")
+# Compressed output deflate hasn't emitted yet; a part is cut this far below the limit
+EXPORT_PART_HEADROOM = 2**20
+
+class ExportWriter:
+    """Streams rows into gzip parts of at most EXPORT_PART_BYTES. A full part
+    is handed to `send` straight away, so memory holds one part at a time
+    however long the history is."""
+
+    def __init__(self, basename: str, fmt: str, columns, tz, send):
+        self.basename = basename
+        self.fmt = fmt
+        self.columns = columns
+        self.tz = tz
+        self.send = send
+        self.parts = 0
+        self.rows = 0
+        self._gz = None
+
+    def _open(self):
+        self._buf = io.BytesIO()
+        self._gz = gzip.GzipFile(fileobj=self._buf, mode="wb")
+        if self.fmt == "csv":
+            self._gz.write((",".join(self.columns) + "\n").encode())
+
+    def _value(self, v):
+        if isinstance(v, datetime):
+            return v.astimezone(self.tz).isoformat()
+        if isinstance(v, date):
+            return v.isoformat()
+        return v
+
+    def _encode(self, rows) -> bytes:
+        if self.fmt == "csv":
+            out = io.StringIO()
+            csv.writer(out, lineterminator="\n").writerows([self._value(v) for v in r] for r in rows)
+            return out.getvalue().encode()
+        return "".join(
+            json.dumps(dict(zip(self.columns, (self._value(v) for v in r)))) + "\n" for r in rows
+        ).encode()
+
+    async def write(self, rows):
+        if self._gz is None:
+            self._open()
+        self._gz.write(self._encode(rows))
+        self.rows += len(rows)
+        if self._buf.tell() >= EXPORT_PART_BYTES - EXPORT_PART_HEADROOM:
+            await self._send_part()
+
+    async def close(self):
+        # An empty history still gets one (header-only) file
+        if self._gz is None and not self.parts:
+            self._open()
+        if self._gz is not None:
+            await self._send_part()
+
+    async def _send_part(self):
+        self._gz.close()
+        self._buf.seek(0)
+        self.parts += 1
+        await self.send(discord.File(self._buf, filename=f"{self.basename}-{self.parts}.{self.fmt}.gz"))
+        self._gz = self._buf = None
+
+def export_queries(uid: int, start: date, start_ts: datetime):
+    """(name, columns, sql, args) for each file an export produces."""
+    return (
+        ("events", ("time", "amount", "unit", "kind", "where"), """
+            SELECT ts, amount, unit, kind, where_logged FROM events
+             WHERE user_id = $1 AND ts >= $2
+            UNION ALL
+            SELECT hour, amount, unit, kind, 'hourly total' FROM events_hourly
+             WHERE user_id = $1 AND hour >= $2
+            ORDER BY 1
+        """, (uid, start_ts)),
+        ("daily", ("date", "total"), """
+            SELECT date, total FROM daily_logs
+             WHERE user_id = $1 AND date >= $2
+             ORDER BY date
+        """, (uid, start)),
     )
-    await ctx.send(msg)
+
+export_slots = asyncio.Semaphore(EXPORT_CONCURRENCY)
+export_cooldowns = {}
+
+@bot.command(name="export")
+async def export(ctx, span: str = "all", fmt: str = "csv"):
+    user = await get_user(ctx.author.id)
+    if not user:
+        return await outbound.send(ctx, "Run `$config` first.")
+    if span.lower() in EXPORT_FORMATS:
+        span, fmt = "all", span
+    fmt = fmt.lower()
+    days, label = parse_report_span(span)
+    if not label or fmt not in EXPORT_FORMATS:
+        return await outbound.send(ctx, "Usage: `$export [days|week|month|year|all] [csv|jsonl]`")
+
+    now = time.monotonic()
+    for uid in [uid for uid, until in export_cooldowns.items() if until <= now]:
+        del export_cooldowns[uid]
+    if ctx.author.id in export_cooldowns:
+        wait = int(export_cooldowns[ctx.author.id] - now) + 1
+        return await outbound.send(ctx, f"⏳ You can export again in {wait} s.")
+    export_cooldowns[ctx.author.id] = now + EXPORT_COOLDOWN_SECONDS
+
+    # History is personal, so files go to DMs unless we're already in one
+    try:
+        target = ctx.channel if ctx.guild is None else await dm_channels.resolve(ctx.author.id)
+    except discord.HTTPException:
+        del export_cooldowns[ctx.author.id]
+        return await outbound.send(ctx, "❌ I couldn't open a DM with you.")
+    if export_slots.locked():
+        await outbound.send(ctx, "⏳ Another export is running; yours will start right after it.")
+
+    tz_name = user["timezone"] or "UTC"
+    tz = get_tz(tz_name)
+    today = tz_now(tz_name).date()
+    start = today - timedelta(days=days - 1) if days else date(1970, 1, 1)
+    start_ts = tz.localize(datetime.combine(start, datetime.min.time()))
+    slug = "all" if days is None else f"{days}d"
+
+    async def send(file):
+        await outbound.send(target, file=file, priority=PRIORITY_SUMMARY)
+
+    async with export_slots:
+        # Anything still in the ingest buffer belongs in the export too
+        await ingest.flush()
+        # A connection of its own: a long export never holds a pool slot the loops need
+        conn = await asyncpg.connect(DATABASE_URL)
+        try:
+            counts = []
+            async with conn.transaction(isolation="repeatable_read", readonly=True):
+                for name, columns, sql, args in export_queries(ctx.author.id, start, start_ts):
+                    writer = ExportWriter(f"bumpy-{name}-{slug}", fmt, columns, tz, send)
+                    chunk = []
+                    async for r in conn.cursor(sql, *args, prefetch=EXPORT_FETCH_ROWS):
+                        chunk.append(r)
+                        if len(chunk) >= EXPORT_FETCH_ROWS:
+                            await writer.write(chunk)
+                            chunk = []
+                    if chunk:
+                        await writer.write(chunk)
+                    await writer.close()
+                    counts.append((name, writer.rows, writer.parts))
+        except discord.Forbidden:
+            dm_channels.mark_closed(ctx.author.id)
+            return await outbound.send(ctx, "❌ I couldn't DM you the export. Allow DMs from server members and try again.")
+        except discord.HTTPException as e:
+            print(f"Export for {ctx.author.id} failed: {e}")
+            return await outbound.send(ctx, "❌ The export failed part-way. Try again later.")
+        finally:
+            await conn.close()
+
+    summary = ", ".join(f"{rows} {name} rows in {parts} file{'s' if parts != 1 else ''}" for name, rows, parts in counts)
+    await outbound.send(target, f"📦 {label} export ({fmt}): {summary}.")
 
 @bot.command(name="status")
 async def status(ctx):
     user = await get_user(ctx.author.id)
     if not user:
-        return await ctx.send("Run `$config` first.")
+        return await outbound.send(ctx, "Run `$config` first.")
     embed = discord.Embed(title=f"📊 {user['name']}'s Status", color=discord.Color.blurple())
     embed.add_field(name="Age", value=user["age"], inline=True)
     embed.add_field(name="Daily Goal", value=f"{user['daily_goal']} {user['unit']}", inline=True)
@@ -444,7 +2455,7 @@ async def status(ctx):
     embed.add_field(name="Coach Role", value=f"<@&{user['coach_role']}>" if user['coach_role'] else "None", inline=True)
     embed.add_field(name="Coach Pings (logs)", value=str(user['coach_ping_logs']), inline=True)
     embed.add_field(name="Coach Pings (reminders)", value=str(user['coach_ping_reminders']), inline=True)
-    await ctx.send(embed=embed)
+    await outbound.send(ctx, embed=embed)
 
 @bot.command(name="help")
 async def help_cmd(ctx):
@@ -457,117 +2468,355 @@ async def help_cmd(ctx):
     embed.add_field(name="$drink <amount>", value="Log intake", inline=False)
     embed.add_field(name="$check", value="Check today’s progress", inline=False)
     embed.add_field(name="$status", value="Show your config", inline=False)
-    embed.add_field(name="$report <7|15|30>", value="Hydration reports", inline=False)
-    await ctx.send(embed=embed)
+    embed.add_field(name="$report <days|week|month|year|all>", value="Hydration reports (e.g. `$report 90`)", inline=False)
+    embed.add_field(name="$export [days|week|month|year|all] [csv|jsonl]", value="Download your history as gzip files, sent by DM", inline=False)
+    await outbound.send(ctx, embed=embed)
 
 # ---------------- Loops ----------------
-@tasks.loop(minutes=1)
+def reminder_increment(u) -> int:
+    # Dynamic increment (assume 16 waking hours)
+    waking_hours = 16
+    reminders_per_day = max(1, (waking_hours * 60) // u["interval_minutes"])
+    return max(1, int(round(u["daily_goal"] / reminders_per_day)))
+
+def echo_reminder(u, increment: int, local_now: datetime):
+    # Optional echo to log channel. Not awaited: echoes are the lowest priority
+    # and a busy or broken log channel mustn't hold up the reminder route
+    if u["log_channel"]:
+        log_ch = bot.get_channel(u["log_channel"])
+        if log_ch:
+            coach_for_log = f" <@&{u['coach_role']}>" if u["coach_role"] and u["coach_ping_logs"] else ""
+            log_digest.post_nowait(
+                log_ch, f"📥 +{increment} {u['unit']} for <@{u['id']}> at {local_now.isoformat()}{coach_for_log}"
+            )
+
+async def send_reminder(u, clock: LocalClock):
+    """Send one reminder. Returns what needs persisting, or None if it failed."""
+    next_at = next_reminder_at(u, clock.now_utc)
+    local_now = clock.now(u["timezone"])
+    increment = reminder_increment(u)
+
+    # Compose & send
+    mention = f"<@{u['id']}>" if u["ping_self"] else ""
+    coach_mention = f" <@&{u['coach_role']}>" if u["coach_role"] and u["coach_ping_reminders"] else ""
+    text = f"💧 {mention}{coach_mention} Time to drink ~ **{increment} {u['unit']}**!"
+    sent_where = "dm"
+
+    try:
+        ch = bot.get_channel(u["reminder_channel"]) if u["reminder_channel"] else None
+        if ch:
+            await outbound.send(ch, text, priority=PRIORITY_REMINDER)
+            sent_where = f"<#{u['reminder_channel']}>"
+        elif not await dm_channels.send(u["id"], text):
+            # DMs closed: nothing was delivered, so don't log an intake for it
+            reminders.schedule(u["id"], next_at)
+            return None
+    except discord.HTTPException as e:
+        # Keep the user on schedule; one failed send shouldn't stall everyone else
+        print(f"Reminder for {u['id']} failed: {e}")
+        reminders.schedule(u["id"], next_at)
+        return None
+    reminders.schedule(u["id"], next_at)
+
+    echo_reminder(u, increment, local_now)
+    return (u["id"], local_now, increment, u["unit"], sent_where, next_at)
+
+async def send_coalesced_reminders(ch, batch, clock: LocalClock):
+    """One message (or as few as fit in 2000 chars) for every reminder due in
+    a shared channel this tick. Mentions only ping users who asked for it."""
+    entries = []
+    for u in batch:
+        increment = reminder_increment(u)
+        coach_mention = f" <@&{u['coach_role']}>" if u["coach_role"] and u["coach_ping_reminders"] else ""
+        line = f"• <@{u['id']}>{coach_mention} ~ **{increment} {u['unit']}**"
+        entries.append((u, increment, line))
+
+    results = []
+    for chunk in chunk_lines(entries, lambda e: e[2], header="💧 Time to drink!"):
+        text = "💧 Time to drink!\n" + "\n".join(line for _, _, line in chunk)
+        pings = discord.AllowedMentions(
+            users=[discord.Object(id=u["id"]) for u, _, _ in chunk if u["ping_self"]],
+            roles=True,
+            everyone=False,
+        )
+        try:
+            await outbound.send(ch, text, allowed_mentions=pings, priority=PRIORITY_REMINDER)
+        except discord.HTTPException as e:
+            print(f"Coalesced reminder to {ch.id} failed: {e}")
+            for u, _, _ in chunk:
+                reminders.schedule(u["id"], next_reminder_at(u, clock.now_utc))
+            continue
+        for u, increment, _ in chunk:
+            next_at = next_reminder_at(u, clock.now_utc)
+            reminders.schedule(u["id"], next_at)
+            local_now = clock.now(u["timezone"])
+            echo_reminder(u, increment, local_now)
+            results.append((u["id"], local_now, increment, u["unit"], f"<#{ch.id}>", next_at))
+    return results
+
+# Reminders already sent whose writes failed; retried with the next tick's
+unsaved_reminders = []
+UNSAVED_REMINDERS_MAX = 100000
+
+async def persist_reminders(sent):
+    """Write a whole tick's reminder side effects in one transaction. If the
+    database is unavailable they're kept and written with the next tick's."""
+    batch = unsaved_reminders + sent
+    if not batch:
+        return
+    # Latest entry per user wins for the users row; events and totals take every entry
+    latest = {entry[0]: entry for entry in batch}
+    try:
+        with timed(DB_QUERY_SECONDS, helper="persist_reminders"):
+            async with db() as conn:
+                async with conn.transaction():
+                    await insert_events(conn, [
+                        (uid, local_now, increment, unit, "reminder", where, None)
+                        for uid, local_now, increment, unit, where, _ in batch
+                    ])
+                    await add_daily_totals(conn, [
+                        (uid, local_now, increment) for uid, local_now, increment, _, _, _ in batch
+                    ])
+                    rows = await conn.fetch("""
+                        UPDATE users AS u
+                           SET last_reminder = v.sent_at, next_reminder_at = v.next_at
+                          FROM unnest($1::bigint[], $2::timestamptz[], $3::timestamptz[]) AS v(id, sent_at, next_at)
+                         WHERE u.id = v.id
+                        RETURNING u.*
+                    """, list(latest), [e[1] for e in latest.values()], [e[5] for e in latest.values()])
+    except DB_ERRORS:
+        if len(batch) > UNSAVED_REMINDERS_MAX:
+            print(f"Dropping {len(batch) - UNSAVED_REMINDERS_MAX} unsaved reminder writes")
+        unsaved_reminders[:] = batch[-UNSAVED_REMINDERS_MAX:]
+        raise
+    unsaved_reminders.clear()
+    for r in rows:
+        user_cache.put(r["id"], r)
+
+@tasks.loop(seconds=0)
 async def reminder_loop():
-    conn = await asyncpg.connect(DATABASE_URL)
-    users = await conn.fetch("SELECT * FROM users")
-    now_utc = datetime.utcnow()
+    # Sleep until the earliest next_reminder_at, then only touch users that are due
+    await reminders.wait()
+    started = time.perf_counter()
+    try:
+        await run_reminder_tick(datetime.now(timezone.utc))
+    except DB_ERRORS as e:
+        # Popped users were put back on the schedule; keep the loop alive
+        print(f"Reminder tick failed: {e!r}")
+    record_tick("reminder", time.perf_counter() - started, 60)
+
+async def run_reminder_tick(now_utc: datetime):
+    # PartitionLeases.refresh waits on this before handing partitions back
+    async with reminder_tick:
+        await _reminder_tick(now_utc)
+
+async def _reminder_tick(now_utc: datetime):
+    due_ids = []
+    for uid, deadline in reminders.pop_due(now_utc):
+        if leases.owns(uid):
+            REMINDER_LATENESS_SECONDS.observe(now_utc.timestamp() - deadline)
+            due_ids.append(uid)
+    if not due_ids:
+        return
+    retry_at = now_utc + timedelta(seconds=REMINDER_RETRY_SECONDS)
+    try:
+        users = await get_users(due_ids)
+    except DB_ERRORS:
+        # Nothing sent yet; pop_due already took them off the heap
+        for uid in due_ids:
+            reminders.schedule(uid, retry_at)
+        raise
 
+    # One queue per destination so a channel still sees its reminders in order,
+    # while different channels/DMs are sent concurrently
+    routes = {}
     for u in users:
         if not u["interval_minutes"] or not u["daily_goal"]:
             continue
+        route = u["reminder_channel"] or ("dm", u["id"])
+        routes.setdefault(route, []).append(u)
 
-        # Due?
-        due = False
-        if u["last_reminder"] is None:
-            due = True
-        else:
-            elapsed = (now_utc - u["last_reminder"]).total_seconds()
-            if elapsed >= u["interval_minutes"] * 60:
-                due = True
-        if not due:
-            continue
-
-        tz_name = u["timezone"] or "UTC"
-        local_now = tz_now(tz_name)
+    limit = asyncio.Semaphore(REMINDER_CONCURRENCY)
+    clock = LocalClock(now_utc)
 
-        # Dynamic increment (assume 16 waking hours)
-        waking_hours = 16
-        reminders_per_day = max(1, (waking_hours * 60) // u["interval_minutes"])
-        increment = max(1, int(round(u["daily_goal"] / reminders_per_day)))
+    sent = []
 
-        # Compose & send
-        mention = f"<@{u['id']}>" if u["ping_self"] else ""
-        coach_mention = f" <@&{u['coach_role']}>" if u["coach_role"] and u["coach_ping_reminders"] else ""
-        sent_where = "dm"
+    async def drain(route, batch):
+        async with limit:
+            ch = bot.get_channel(route) if REMINDER_COALESCE and isinstance(route, int) else None
+            if ch and len(batch) > 1:
+                sent.extend(await send_coalesced_reminders(ch, batch, clock))
+                return
+            # Queue the whole route at once: the dispatcher keeps it in order, and
+            # lower-priority echoes can't slip into the gaps between reminders
+            results = await asyncio.gather(*(send_reminder(u, clock) for u in batch), return_exceptions=True)
+            sent.extend(r for r in results if r and not isinstance(r, Exception))
+            for r in results:
+                if isinstance(r, Exception):
+                    raise r
 
-        if u["reminder_channel"]:
-            ch = bot.get_channel(u["reminder_channel"])
-            if ch:
-                await ch.send(f"💧 {mention}{coach_mention} Time to drink ~ **{increment} {u['unit']}**!")
-                sent_where = f"<#{u['reminder_channel']}>"
-            else:
-                user_obj = await bot.fetch_user(u["id"])
-                if user_obj:
-                    await user_obj.send(f"💧 {mention}{coach_mention} Time to drink ~ **{increment} {u['unit']}**!")
-        else:
-            user_obj = await bot.fetch_user(u["id"])
-            if user_obj:
-                await user_obj.send(f"💧 {mention}{coach_mention} Time to drink ~ **{increment} {u['unit']}**!")
+    # One failing route mustn't lose what the others already sent
+    results = await asyncio.gather(*(drain(route, batch) for route, batch in routes.items()), return_exceptions=True)
+    for route, result in zip(routes, results):
+        if isinstance(result, Exception):
+            print(f"Reminders for route {route} failed: {result!r}")
+    # Users a failed route never got to are retried rather than dropped from the heap
+    for u in users:
+        if u["interval_minutes"] and u["daily_goal"] and u["id"] not in reminders:
+            reminders.schedule(u["id"], retry_at)
+    await persist_reminders(sent)
 
-        # Update reminder time
-        await conn.execute("UPDATE users SET last_reminder=$1 WHERE id=$2", now_utc, u["id"])
+async def rollover_timezone(tz_name: str, today):
+    """Close out yesterday for every user in one timezone with a single query."""
+    yesterday = today - timedelta(days=1)
+    with timed(DB_QUERY_SECONDS, helper="rollover_timezone"):
+        async with db() as conn:
+            rows = await conn.fetch("""
+                WITH closing AS (
+                    SELECT u.id, coalesce(d.total, 0) AS total,
+                           CASE WHEN u.daily_goal > 0 AND coalesce(d.total, 0) >= u.daily_goal
+                                THEN u.goal_streak + 1 ELSE 0 END AS streak
+                      FROM users u
+                      LEFT JOIN daily_logs d ON d.user_id = u.id AND d.date = $3
+                     WHERE coalesce(u.timezone, 'UTC') = $1
+                       AND u.last_reset IS DISTINCT FROM $2
+                       AND ((u.id >> 22) % $4) = ANY($5::int[])
+                )
+                UPDATE users AS u
+                   SET last_reset = $2,
+                       goal_streak = c.streak,
+                       best_goal_streak = greatest(u.best_goal_streak, c.streak)
+                  FROM closing c
+                 WHERE u.id = c.id
+                RETURNING u.id, u.log_channel, u.daily_goal, u.unit, u.coach_role, u.coach_ping_logs, c.total
+            """, tz_name, today, yesterday, REMINDER_PARTITIONS, list(leases.owned))
 
-        # Log reminder intake & add to totals
-        await add_daily_total(u["id"], local_now.date(), increment)
-        await log_event(u["id"], local_now, increment, u["unit"], "reminder", sent_where)
+    for u in rows:
+        # Only last_reset and the streaks changed; let the next lookup refetch the row
+        user_cache.invalidate(u["id"])
+        total = u["total"]
 
-        # Optional echo to log channel
         if u["log_channel"]:
-            log_ch = bot.get_channel(u["log_channel"])
-            if log_ch:
-                coach_for_log = f" <@&{u['coach_role']}>" if u["coach_role"] and u["coach_ping_logs"] else ""
-                await log_ch.send(
-                    f"📥 +{increment} {u['unit']} for <@{u['id']}> at {local_now.isoformat()}{coach_for_log}"
+            channel = bot.get_channel(u["log_channel"])
+            if channel:
+                percent = (total / u["daily_goal"]) * 100 if u["daily_goal"] else 0
+                emoji = "🎯" if percent >= 100 else "💤"
+                coach_mention = f" <@&{u['coach_role']}>" if u["coach_role"] and u["coach_ping_logs"] else ""
+                msg = (
+                    f"📅 Daily Summary for {yesterday}\n"
+                    f"💧 {total}/{u['daily_goal']} {u['unit']} ({percent:.1f}%) {emoji}{coach_mention}"
                 )
+                # Not awaited: one busy log channel's rate limit mustn't hold up the
+                # rest of this zone, or the zones whose midnight comes after it
+                outbound.send_nowait(channel, msg, priority=PRIORITY_SUMMARY)
 
-    await conn.close()
-
-@tasks.loop(minutes=5)
+@tasks.loop(seconds=0)
 async def reset_loop():
-    conn = await asyncpg.connect(DATABASE_URL)
-    users = await conn.fetch("SELECT * FROM users")
+    # Wake exactly at the next local midnight of any known timezone
+    await midnights.wait()
+    started = time.perf_counter()
+    await run_reset_tick(datetime.now(timezone.utc))
+    record_tick("reset", time.perf_counter() - started, 300)
 
-    for u in users:
-        tz_name = u["timezone"] or "UTC"
-        local_now = tz_now(tz_name)
+async def run_reset_tick(now_utc: datetime):
+    clock = LocalClock(now_utc)
+    for tz_name, _ in midnights.pop_due(now_utc):
+        try:
+            await rollover_timezone(tz_name, clock.today(tz_name))
+        except DB_ERRORS as e:
+            # last_reset makes the rollover safe to repeat, so just try this zone again soon
+            print(f"Rollover for {tz_name} failed: {e!r}")
+            midnights.schedule(tz_name, now_utc + timedelta(seconds=REMINDER_RETRY_SECONDS))
+            continue
+        midnights.schedule(tz_name, next_local_midnight(tz_name, now_utc))
 
-        # New local day?
-        if u["last_reset"] != local_now.date():
-            yesterday = local_now.date() - timedelta(days=1)
+@reset_loop.before_loop
+async def before_reset_loop():
+    while True:
+        try:
+            async with db() as conn:
+                zones = await conn.fetch("SELECT DISTINCT coalesce(timezone, 'UTC') AS tz FROM users")
+            break
+        except DB_ERRORS as e:
+            # reset_loop only starts once this returns; an error here would stop it for good
+            print(f"Loading timezones failed: {e!r}; retrying in {REMINDER_RETRY_SECONDS:g}s")
+            await asyncio.sleep(REMINDER_RETRY_SECONDS)
+    # Due right away, so days that ended while we were offline get summarised on boot
+    now_utc = datetime.now(timezone.utc)
+    for z in zones:
+        midnights.schedule(z["tz"], now_utc)
 
-            row = await conn.fetchrow(
-                "SELECT total FROM daily_logs WHERE user_id=$1 AND date=$2",
-                u["id"], yesterday
-            )
-            total = row["total"] if row else 0
-
-            if u["log_channel"]:
-                channel = bot.get_channel(u["log_channel"])
-                if channel:
-                    percent = (total / u["daily_goal"]) * 100 if u["daily_goal"] else 0
-                    emoji = "🎯" if percent >= 100 else "💤"
-                    coach_mention = f" <@&{u['coach_role']}>" if u["coach_role"] and u["coach_ping_logs"] else ""
-                    msg = (
-                        f"📅 Daily Summary for {yesterday}\n"
-                        f"💧 {total}/{u['daily_goal']} {u['unit']} ({percent:.1f}%) {emoji}{coach_mention}"
-                    )
-                    await channel.send(msg)
+@tasks.loop(seconds=INGEST_FLUSH_SECONDS)
+async def ingest_flush_loop():
+    await ingest.flush()
 
-            # Mark today as reset to prevent multiple posts
-            await conn.execute("UPDATE users SET last_reset=$1 WHERE id=$2", local_now.date(), u["id"])
+@tasks.loop(seconds=max(LOG_DIGEST_SECONDS, 1))
+async def log_digest_loop():
+    await log_digest.flush()
 
-    await conn.close()
+MAINTENANCE_HOURS = 6
+
+@tasks.loop(hours=MAINTENANCE_HOURS)
+async def maintenance_loop():
+    # Keep next months' events partitions ahead of the clock and apply retention
+    try:
+        async with db() as conn:
+            await ensure_event_partitions(conn)
+            await compact_events(conn)
+    except DB_ERRORS as e:
+        # tasks.loop doesn't retry DB errors itself; without this the loop would end
+        print(f"Maintenance failed: {e!r}; retrying in {REMINDER_RETRY_SECONDS:g}s")
+        maintenance_loop.change_interval(seconds=REMINDER_RETRY_SECONDS)
+        return
+    maintenance_loop.change_interval(hours=MAINTENANCE_HOURS)
+
+@tasks.loop(seconds=LEASE_REFRESH_SECONDS)
+async def lease_loop():
+    await refresh_leases()
+
+@bot.event
+async def setup_hook():
+    # Once per process, before the gateway connects. on_ready fires again
+    # after every reconnect, so nothing expensive or one-shot belongs there.
+    await init_pool()
+    await migrate()
+    ingest.open()
+    await ingest.recover()
+    await start_metrics_server()
+    # Claims this worker's partitions and preloads their users and schedules.
+    # Stay off the gateway until our index and shards are ours, or two
+    # processes would both answer every command.
+    await refresh_leases()
+    while not leases.connected:
+        await asyncio.sleep(LEASE_REFRESH_SECONDS)
+        await refresh_leases()
 
 @bot.event
 async def on_ready():
-    await init_db()
-    reminder_loop.start()
-    reset_loop.start()
-    print(f"Bumpy online as {bot.user}")
+    dm_channels.warm(bot)
+    loops = [lease_loop, reminder_loop, reset_loop, maintenance_loop, ingest_flush_loop]
+    if log_digest.enabled:
+        loops.append(log_digest_loop)
+    started = [loop for loop in loops if not loop.is_running()]
+    for loop in started:
+        loop.start()
+    log_memory("after ready")
+    if started:
+        print(f"Bumpy online as {bot.user}: {len(reminders)} reminders scheduled, {user_cache.stats()['size']} users cached")
+    else:
+        print(f"Bumpy reconnected as {bot.user}")
+
+@bot.event
+async def on_message(message):
+    # Most traffic isn't for us; skip building a command Context for it
+    if message.author.bot:
+        return
+    if message.content.startswith(bot.command_prefix):
+        await bot.process_commands(message)
+    else:
+        # Answers to $config / $drink questions: one dict lookup
+        sessions.feed(message)
 
-bot.run(TOKEN)
+if __name__ == "__main__":
+    log_memory("at startup")
+    bot.run(TOKEN)